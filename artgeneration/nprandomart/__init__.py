@@ -1,3 +1,26 @@
-from .randomart import generate, get_art
-from .treevisualisation import tree_as_ascii
-from .image import get_image
+"""
+the functions of the package are imported on first use (PEP 562), as the modules that implement them
+import numba, PIL and friends, which take long to import
+"""
+
+import importlib
+
+# module by function
+_functions = {'generate': 'randomart', 'get_art': 'randomart', 'tree_as_ascii': 'treevisualisation',
+              'get_image': 'image', 'warmup': 'fractal', 'structural_hash': 'serialization'}
+
+__all__ = list(_functions)
+
+
+def __getattr__(name):
+    try:
+        module = _functions[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    function = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = function
+    return function
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
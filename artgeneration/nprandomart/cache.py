@@ -0,0 +1,78 @@
+"""
+a thread safe, least-recently-used cache that is bounded by the number of bytes of the cached values
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes=256e6, sizeof=lambda value: value.nbytes):
+        """
+        :param max_bytes: the least recently used values are evicted when the cached values take more bytes
+        :param sizeof: function that returns the number of bytes of a value, by default the nbytes of an array
+        """
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key][0]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        with self.lock:
+            if key in self.data:
+                self.bytes -= self.data.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return  # would evict everything else
+            self.data[key] = (value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.data.popitem(last=False)[1][1]
+
+    def get_or_compute(self, key, compute):
+        """
+        return the cached value, or compute and cache it. The computation is done outside of the lock,
+        so two threads may compute the same value at the same time.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def info(self):
+        """hit/miss statistics and memory use"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.,
+                    'items': len(self.data),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes}
@@ -0,0 +1,521 @@
+"""
+compilation of the art (expression tree) into a flat evaluation program.
+
+The recursive Operator.eval allocates fresh, full size arrays for every channel of every node.
+compile_art lowers the tree into a linear list of instructions that operate on a small pool of
+reusable buffers (registers), using in-place numpy ufunc calls (out=...). Structurally identical
+subtrees are evaluated only once, and the channels are evaluated one after another so that only a
+third of the intermediate results is alive at any time. Instructions are numbered by their opcode,
+arguments and parameters, so that the channels share the computations they have in common: x, y and
+the fractals are the same in all channels, and so is everything computed from them until e.g. a Constant
+(with a different color per channel) is involved. The resulting pixels are bit-identical
+to the ones of the recursive evaluation.
+
+The values are kept in the smallest shape that holds them: a value that depends on x only is a single
+row (1, width), one that depends on y only a single column (height, 1), and a constant a single element.
+numpy's broadcasting makes a full (height, width) array only where a row and a column value meet.
+Subtrees of x (or y) alone thus take linear instead of quadratic time in the size of the image.
+
+A program compiled with nodes=True can capture the outputs of all nodes of the tree while it runs, e.g. as the
+thumbnails of the tree plot, so that the nodes need not be evaluated once more (see image.get_image_with_thumbnails).
+
+A program can also be run on a band of rows of the image (see image.py), the weights of the Mix operators,
+which are means over the whole image, then have to be computed beforehand and passed to compile_art.
+
+The outputs of subtrees can be memoized across programs (renders, and arts that have subtrees in common) in an
+LRUCache such as subtrees, by (structural key, channel, size, dtype): a subtree that is found in the cache is
+loaded instead of compiled. Only subtrees of full size values (that depend on both x and y) are memoized, the others
+take little time to compute, and only the large ones are stored, as storing takes a copy of the value.
+"""
+
+from collections import namedtuple, defaultdict
+import numpy as np
+from .cache import LRUCache
+from .randomart import VariableX, VariableY, Constant, Average, Product, Mod, Well, Tent, Sin, Level, Mix, mean
+from .mandle import Mandle
+
+Instruction = namedtuple('Instruction', ['opcode', 'out', 'args', 'params'])
+
+# the slots of the input coordinate grids
+X, Y = 0, 1
+
+# the shape kind of a value is a bitmask of the coordinates it depends on
+SCALAR, ROW, COLUMN, FULL = 0, 1, 2, 3
+
+# the attributes holding the sub-expressions, and the parameters, of the operators the compiler knows about;
+# operators that are not listed here are evaluated by calling their own eval method
+children = {VariableX: (), VariableY: (), Constant: (), Mandle: (),
+            Average: ('e1', 'e2'), Product: ('e1', 'e2'), Mod: ('e1', 'e2'),
+            Well: ('e',), Tent: ('e',), Sin: ('e',),
+            Level: ('level', 'e1', 'e2'), Mix: ('w', 'e1', 'e2')}
+
+parameters = {Constant: ('c1', 'c2', 'c3'), Sin: ('phase', 'freq'), Level: ('treshold',), Mix: ('weighing_color',),
+              Mandle: ('xmin', 'xmax', 'ymin', 'ymax', 'maxiter', 'normalize_to_one')}
+
+# scratch buffers needed by an instruction on top of its output: 'f' for float, 'b' for boolean,
+# and the index of the argument whose shape it has
+scratch = {'average': ('f', 1), 'mix': ('f', 1), 'mod': ('b', 1), 'level': ('b', 0)}
+
+# the outputs of subtrees, by (structural key, channel, size, dtype), shared by all arts (and threads) in the process
+# that render with get_image(memo=True); applications that size their own cache pass an LRUCache as memo instead
+subtrees = LRUCache(max_bytes=256e6)
+
+
+# kernels; each one writes the result of an instruction into the output buffer.
+# The order of the numpy calls is such that the output buffer may be one of the inputs.
+
+def _fill(out, c):
+    out.fill(c)
+
+
+def _product(out, a, b):
+    np.multiply(a, b, out=out)
+
+
+def _average(out, a, b, w, tmp):
+    np.multiply(b, 1 - w, out=tmp)
+    np.multiply(a, w, out=out)
+    np.add(out, tmp, out=out)
+
+
+def _mod(out, a, b, mask):
+    np.greater(b, 0, out=mask)
+    np.remainder(a, b, out=out)
+    np.logical_not(mask, out=mask)
+    np.copyto(out, 0., where=mask)
+
+
+def _well(out, a):
+    np.multiply(a, a, out=out)
+    np.add(out, 1, out=out)
+    np.power(out, 8, out=out)
+    np.divide(2, out, out=out)
+    np.subtract(1, out, out=out)
+
+
+def _tent(out, a):
+    np.abs(a, out=out)
+    np.multiply(out, 2, out=out)
+    np.subtract(1, out, out=out)
+
+
+def _sin(out, a, phase, freq):
+    np.multiply(a, freq, out=out)
+    np.add(out, phase, out=out)
+    np.sin(out, out=out)
+
+
+def _level(out, level, a, b, treshold, mask):
+    np.less(level, treshold, out=mask)
+    if out is b:
+        np.copyto(out, a, where=mask)
+    elif out is a:
+        np.logical_not(mask, out=mask)
+        np.copyto(out, b, where=mask)
+    else:
+        np.copyto(out, b)
+        np.copyto(out, a, where=mask)
+
+
+class Program:
+    """
+    a compiled art: a list of instructions over a set of slots. The first two slots hold the input
+    x coordinates (a row) and y coordinates (a column), followed by the registers and the slots for values
+    that are not owned by the program (the fractals, the outputs of operators that were evaluated by their
+    own eval, and the Mix weights).
+    """
+
+    def __init__(self, instructions, outputs, registers, n_slots, nodes=None):
+        """
+        :param registers: ('f' or 'b', shape kind) of each register
+        :param nodes: the outputs of the nodes, if they can be captured: by index of the instruction that computes
+        them (-1 for x and y), a list of (slot, channel, ids of the operators)
+        """
+        self.instructions = instructions
+        self.outputs = outputs
+        self.registers = registers
+        self.n_slots = n_slots
+        self.nodes = nodes
+
+    def __repr__(self):
+        n_full = sum(kind == FULL for _, kind in self.registers)
+        return f'Program({len(self.instructions)} instructions, {len(self.registers)} registers, ' \
+               f'{n_full} of full size)'
+
+    def prepare(self, size, dtype=np.float64):
+        """compute the fractals beforehand, so that bands can be run concurrently"""
+        for ins in self.instructions:
+            if ins.opcode == 'fractal':
+                ins.params[0].get_fractal(size, dtype)
+
+    def run(self, x, y, size=None, start=0, capture=None, step=1):
+        """
+        evaluate the program on the coordinate grids x and y (as made by np.meshgrid), in their float type
+        :param size: width and height of the whole image, if x and y are a band of its rows
+        :param start: the index of the first row of the band
+        :param capture: dict that is filled with the output (r, g, b) of every node, by id of the operator;
+        the program must be compiled with nodes=True. The nodes of the w expression of a Mix are evaluated
+        for its weighing color only, their other channels are None.
+        :param step: the outputs are captured at every step-th pixel (in both directions)
+        :return: (r, g, b), or the channels that were compiled, as arrays of the shape of x
+        """
+        if size is None:
+            size = x.shape[1]
+        if capture is not None and self.nodes is None:
+            raise ValueError('the outputs of the nodes can only be captured if compiled with nodes=True')
+        shapes = {SCALAR: (1, 1), ROW: (1, x.shape[1]), COLUMN: (x.shape[0], 1), FULL: x.shape}
+        s = [x[:1, :], y[:, :1]]
+        s += [np.empty(shapes[kind], dtype=x.dtype if t == 'f' else bool) for t, kind in self.registers]
+        s += [None] * (self.n_slots - len(s))
+
+        def capture_nodes(i):
+            samples = {}  # a value is often the output of several channels (and nodes)
+            for slot, channel, ids in self.nodes.get(i, ()):
+                if slot not in samples:
+                    samples[slot] = np.broadcast_to(s[slot], x.shape)[::step, ::step].copy()
+                sample = samples[slot]
+                for op_id in ids:
+                    capture.setdefault(op_id, [None] * 3)[channel] = sample
+
+        stored = []
+        if capture is not None:
+            capture_nodes(-1)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):  # as set in randomart.py, but that is per thread
+            for i, (opcode, out, args, params) in enumerate(self.instructions):
+                if opcode == 'call':
+                    if x.shape[0] != size:
+                        raise ValueError(f'{params[0]} can only be evaluated on the whole image')
+                    s[out[0]], s[out[1]], s[out[2]] = params[0].eval(x, y)
+                elif opcode in ('load', 'store', 'store_output') and x.shape[0] != size:
+                    raise ValueError('memoized subtrees can only be evaluated on the whole image')
+                elif opcode == 'load':
+                    s[out] = params[0]
+                elif opcode == 'store':
+                    value = s[args[0]].copy()
+                    value.flags.writeable = False  # it may be loaded as (an output of) another program
+                    memo, keys = params
+                    for key in keys:
+                        memo.put(key, value)
+                elif opcode == 'store_output':  # stored once the program has run, without a copy
+                    stored.append((s[args[0]], params))
+                elif opcode == 'fractal':
+                    s[out] = params[0].get_fractal(size, x.dtype)[start:start + x.shape[0]]
+                elif opcode == 'mean':
+                    s[out] = mean(_full(s[args[0]], x.shape))  # the same summation as by the recursive eval and in bands
+                elif opcode == 'fill':
+                    _fill(s[out], *params)
+                elif opcode == 'product':
+                    _product(s[out], s[args[0]], s[args[1]])
+                elif opcode == 'average':
+                    _average(s[out], s[args[0]], s[args[1]], params[0], s[args[2]])
+                elif opcode == 'mix':
+                    _average(s[out], s[args[0]], s[args[1]], s[args[2]], s[args[3]])
+                elif opcode == 'mod':
+                    _mod(s[out], s[args[0]], s[args[1]], s[args[2]])
+                elif opcode == 'well':
+                    _well(s[out], s[args[0]])
+                elif opcode == 'tent':
+                    _tent(s[out], s[args[0]])
+                elif opcode == 'sin':
+                    _sin(s[out], s[args[0]], *params)
+                elif opcode == 'level':
+                    _level(s[out], s[args[0]], s[args[1]], s[args[2]], *params, s[args[3]])
+                else:
+                    raise ValueError(f'unknown opcode {opcode}')
+                if capture is not None:
+                    capture_nodes(i)
+
+        if capture is not None:
+            for op_id, channels in capture.items():
+                capture[op_id] = tuple(channels)
+        for value, (memo, keys) in stored:
+            value.flags.writeable = False
+            for key in keys:
+                memo.put(key, value)
+        return tuple(_full(s[v], x.shape) for v in self.outputs)
+
+
+def _full(a, shape):
+    """the value as a (contiguous) array of the given shape"""
+    if a.shape == shape:
+        return a
+    return np.broadcast_to(a, shape).copy()
+
+
+class _Lowering:
+    """
+    translates the tree into instructions on (single assignment) values.
+    Values are numbered, 0 and 1 are the input grids.
+    """
+
+    def __init__(self, weights, memo=None, size=None, dtype=np.float64):
+        self.weights = weights
+        self.memo = memo
+        self.memo_key = (size, np.dtype(dtype).name)
+        self.instructions = []
+        self.n_values = 2
+        self.owned = set()  # the values that are computed by the program into its own registers
+        self.kinds = {X: ROW, Y: COLUMN}  # the shape kind of each value
+        self.keys = {}
+        self.values = {}
+        self.numbers = {}  # value by (opcode, args, params) of the instructions
+        self.statics = {}
+        self.stores = {}  # the keys under which each value is memoized
+        self.min_store_cost = 0
+
+    def new_value(self, owned=True, kind=FULL):
+        v = self.n_values
+        self.n_values += 1
+        if owned:
+            self.owned.add(v)
+        self.kinds[v] = kind
+        return v
+
+    def emit(self, opcode, args=(), params=()):
+        number = (opcode, tuple(args), tuple(params))
+        try:
+            return self.numbers[number]
+        except KeyError:
+            pass
+        kind = SCALAR
+        for v in args:
+            kind |= self.kinds[v]
+        out = self.new_value(kind=kind)
+        self.instructions.append(Instruction(opcode, out, tuple(args), tuple(params)))
+        self.numbers[number] = out
+        return out
+
+    def key(self, op):
+        """structural key of a subtree, so that identical subtrees are evaluated only once"""
+        try:
+            return self.keys[id(op)]
+        except KeyError:
+            pass
+        cls = type(op)
+        if cls in children:
+            key = (cls.__name__,
+                   tuple(getattr(op, p) for p in parameters.get(cls, ())),
+                   tuple(self.key(getattr(op, c)) for c in children[cls]))
+        else:
+            key = ('call', id(op))
+        self.keys[id(op)] = key
+        return key
+
+    def static(self, op):
+        """
+        the shape kind of the output of op, known from its leaves, and the number of full size values in its
+        subtree; the kind is None if the subtree holds an operator that is evaluated by its own eval
+        """
+        try:
+            return self.statics[id(op)]
+        except KeyError:
+            pass
+        cls = type(op)
+        kind, cost = None, 0
+        if cls is VariableX:
+            kind = ROW
+        elif cls is VariableY:
+            kind = COLUMN
+        elif cls is Mandle:
+            kind = FULL
+        elif cls in children:
+            kind = SCALAR
+            for c in children[cls]:
+                k, n = self.static(getattr(op, c))
+                if k is None:
+                    kind = None
+                    break
+                if c != 'w':  # the weight of a Mix is a scalar
+                    kind |= k
+                cost += n
+            else:
+                cost += kind == FULL
+        self.statics[id(op)] = (kind, cost)
+        return kind, cost
+
+    def lower(self, op, channel):
+        """return the value holding the given channel of the output of op"""
+        key = (self.key(op), channel)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        cls = type(op)
+        if cls not in children:
+            outs = tuple(self.new_value(owned=False) for _ in range(3))
+            self.instructions.append(Instruction('call', outs, (), (op,)))
+            for c in range(3):
+                self.values[(self.key(op), c)] = outs[c]
+            return outs[channel]
+
+        memo_key = None
+        if self.memo is not None and children[cls] and self.static(op)[0] == FULL:
+            memo_key = (self.key(op), channel) + self.memo_key
+            value = self.memo.get(memo_key)
+            if value is not None:
+                v = self.new_value(owned=False)
+                self.instructions.append(Instruction('load', v, (), (value,)))
+                self.values[key] = v
+                return v
+            if self.static(op)[1] < self.min_store_cost:
+                memo_key = None  # looked up, but not worth the copy to store it
+
+        sub = [self.lower(getattr(op, c), channel) for c in children[cls] if c != 'w']
+        if cls is VariableX:
+            v = X
+        elif cls is VariableY:
+            v = Y
+        elif cls is Mandle:
+            v = self.new_value(owned=False)
+            self.instructions.append(Instruction('fractal', v, (), (op,)))
+            for c in range(3):
+                self.values[(self.key(op), c)] = v
+        elif cls is Constant:
+            v = self.emit('fill', params=((op.c1, op.c2, op.c3)[channel],))
+        elif cls is Average:
+            v = self.emit('average', sub, (0.5,))
+        elif cls is Product:
+            v = self.emit('product', sub)
+        elif cls is Mod:
+            v = self.emit('mod', sub)
+        elif cls is Well:
+            v = self.emit('well', sub)
+        elif cls is Tent:
+            v = self.emit('tent', sub)
+        elif cls is Sin:
+            v = self.emit('sin', sub, (op.phase, op.freq))
+        elif cls is Level:
+            v = self.emit('level', sub, (op.treshold,))
+        elif id(op) in self.weights:  # Mix with a known weight
+            v = self.emit('average', sub, (self.weights[id(op)],))
+        else:  # Mix
+            v = self.emit('mix', sub + [self.lower_weight(op)])
+        if memo_key is not None:
+            if v not in self.stores:  # a value shared by the channels is copied once
+                self.stores[v] = []
+                self.instructions.append(Instruction('store', (), (v,), (self.memo, self.stores[v])))
+            self.stores[v].append(memo_key)
+        self.values[key] = v
+        return v
+
+    def lower_weight(self, op):
+        """the (scalar) weight of a Mix operator: the mean of one of the channels of its w expression"""
+        key = ('mean', self.key(op.w), op.weighing_color)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        w = self.lower(op.w, {'r': 0, 'g': 1, 'b': 2}[op.weighing_color])
+        out = self.new_value(owned=False, kind=SCALAR)
+        self.instructions.append(Instruction('mean', out, (w,), ()))
+        self.values[key] = out
+        return out
+
+
+def compile_art(art, weights=None, channels=(0, 1, 2), nodes=False, memo=None, size=None, dtype=np.float64,
+                store_fraction=0.5):
+    """
+    compile the art (expression tree) into a Program.
+    :param art: the root Operator of the tree
+    :param weights: the weights of Mix operators, by id of the operator, that are known beforehand
+    :param channels: the channels to compute
+    :param nodes: make a program that can capture the outputs of all nodes (see Program.run)
+    :param memo: cache of the outputs of subtrees (e.g. subtrees) to load them from, and store them in; the program
+    must then be run on the whole image of the given size and dtype
+    :param store_fraction: the subtrees that have at least this fraction of the full size values of the tree are
+    stored in memo, all are looked up
+    :return: Program
+    """
+    if nodes and memo is not None:
+        raise ValueError('the outputs of the nodes can not be captured if subtrees are memoized')
+    lowering = _Lowering(weights or {}, memo, size, dtype)
+    if memo is not None:
+        # storing a value takes a copy of it; only the subtrees that hold a good part of the work are stored
+        lowering.min_store_cost = lowering.static(art)[1] * store_fraction
+
+    # evaluating the channels one after another keeps fewer intermediate results alive
+    outputs = tuple(lowering.lower(art, c) for c in channels)
+    instructions = lowering.instructions
+
+    last_use = {}
+    for i, ins in enumerate(instructions):
+        for v in ins.args:
+            last_use[v] = i
+    for v in outputs:
+        last_use[v] = len(instructions)
+
+    # register allocation, registers are of a type ('f' or 'b') and a shape kind;
+    # values that are not owned get a slot of their own
+    kinds = lowering.kinds
+    registers = []
+    assigned = {}
+    free = defaultdict(list)
+
+    def allocate(register_type):
+        if free[register_type]:
+            return free[register_type].pop()
+        registers.append(register_type)
+        return len(registers) - 1
+
+    allocated = []
+    for i, ins in enumerate(instructions):
+        dying = [v for v in dict.fromkeys(ins.args) if v in lowering.owned and last_use[v] == i]
+        outs = ins.out if isinstance(ins.out, tuple) else (ins.out,)
+        for v in outs:
+            if v in lowering.owned:
+                # the kernels allow the output to be one of the inputs, if it has the same shape
+                same_kind = [u for u in dying if kinds[u] == kinds[v]]
+                if same_kind:
+                    dying.remove(same_kind[0])
+                    assigned[v] = assigned[same_kind[0]]
+                else:
+                    assigned[v] = allocate(('f', kinds[v]))
+        tmp = None
+        if ins.opcode in scratch:
+            register_type, arg = scratch[ins.opcode]
+            tmp = allocate((register_type, kinds[ins.args[arg]]))
+        for v in dying:
+            free[registers[assigned[v]]].append(assigned[v])
+        if tmp is not None:
+            free[registers[tmp]].append(tmp)
+        allocated.append(tmp)
+
+    n_slots = 2 + len(registers)
+    slots = {X: X, Y: Y}
+    for v in range(2, lowering.n_values):
+        if v in assigned:
+            slots[v] = 2 + assigned[v]
+        else:
+            slots[v] = n_slots
+            n_slots += 1
+
+    program = []
+    for ins, tmp in zip(instructions, allocated):
+        out = tuple(slots[v] for v in ins.out) if isinstance(ins.out, tuple) else slots[ins.out]
+        args = tuple(slots[v] for v in ins.args)
+        if tmp is not None:
+            args += (2 + tmp,)
+        opcode = ins.opcode
+        if opcode == 'store' and ins.args[0] in outputs:
+            opcode = 'store_output'  # its register holds it until the end
+        program.append(Instruction(opcode, out, args, ins.params))
+
+    node_outputs = None
+    if nodes:
+        defined = {X: -1, Y: -1}  # the instruction that computes each value
+        for i, ins in enumerate(instructions):
+            for v in (ins.out if isinstance(ins.out, tuple) else (ins.out,)):
+                defined[v] = i
+        ids = defaultdict(list)  # the ids of the (identical) operators by structural key
+        for op_id, key in lowering.keys.items():
+            ids[key].append(op_id)
+        node_outputs = defaultdict(list)
+        for key, v in lowering.values.items():
+            if key[0] == 'mean':  # the weight of a Mix
+                continue
+            key, channel = key
+            node_outputs[defined[v]].append((slots[v], channel, ids[key]))
+        node_outputs = dict(node_outputs)
+
+    return Program(program, tuple(slots[v] for v in outputs), tuple(registers), n_slots, node_outputs)
@@ -0,0 +1,121 @@
+"""
+the numba kernels of the mandlebrot set calculation (see mandle.get_mandlebrot).
+They are in a module of their own, so that numba is only imported when a fractal is computed; the compiled
+kernels are cached on disk (cache=True), so that only the first process compiles them.
+"""
+
+import threading
+from numba import njit, prange, get_num_threads, config
+import numpy as np
+
+# start numba's threads now, in the importing (normally the main) thread; with the tbb threading layer the process
+# hangs at exit when they are started by another thread, e.g. by a request handler or render job of the web app.
+# The omp threading layer, which is thread safe as well, does not, so it is preferred when imported by another thread
+if threading.current_thread() is not threading.main_thread():
+    config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+get_num_threads()
+
+
+def warmup():
+    """
+    import numba, start its threads, and compile the kernel (or load it from the cache), so that the first
+    fractal does not wait for it. Call it from the main thread, before rendering in other threads, e.g. when
+    a server process starts.
+    """
+    mandlebrot_grid(np.zeros(2), np.zeros(2), 1, False)
+
+
+@njit(parallel=True, cache=True)
+def mandlebrot_grid(real_axis, imag_axis, maxiter, smooth):
+    mandle = np.empty((real_axis.size, imag_axis.size), dtype=real_axis.dtype)
+    for i in prange(real_axis.size):
+        for j in range(imag_axis.size):
+            if smooth:
+                mandle[i, j] = mandelbrot_single_point_smooth(real_axis[i], imag_axis[j], maxiter)
+            else:
+                mandle[i, j] = mandelbrot_single_point(real_axis[i], imag_axis[j], maxiter)
+    return mandle
+
+
+@njit(cache=True)
+def in_main_bulbs(creal, cimag):
+    """
+    whether the point lies in the main cardioid or in the period-2 bulb,
+    these points are in the set, and would take maxiter iterations to find out.
+    """
+    x = creal - 0.25
+    q = x * x + cimag * cimag
+    if q * (q + x) <= 0.25 * cimag * cimag:
+        return True
+    return (creal + 1) * (creal + 1) + cimag * cimag <= 0.0625
+
+
+@njit(cache=True)
+def mandelbrot_single_point(creal, cimag, maxiter):
+    """
+    largely based on http://numba.pydata.org/numba-doc/0.21.0/user/examples.html
+    plus added further optimizations:
+    make the code run faster by avoiding a square root computation when
+    computing np.abs(z) > 2 .  We can get an equivalent condition by squaring both sides, which yields:
+    z.real * z.real + z.imag * z.imag > 4
+    We can do even better, by breaking the complex number into its constituents.
+    Points in the main cardioid and period-2 bulb are not iterated, and the iteration stops when the orbit
+    returns exactly to a previous point (periodicity checking); such points are in the set.
+    The arithmetic is done in the precision of creal and cimag.
+    :param creal:
+    :param cimag:
+    :param maxiter:
+    :return:
+    """
+    if in_main_bulbs(creal, cimag):
+        return 0
+    real = creal
+    imag = cimag
+    saved_real = real
+    saved_imag = imag
+    period = 8
+    for n in range(maxiter):
+        real2 = real * real
+        imag2 = imag * imag
+        if real2 + imag2 > 4.0:
+            return n
+        real_imag = real * imag
+        imag = real_imag + real_imag + cimag  # same as 2 * real * imag, but keeps the precision
+        real = real2 - imag2 + creal
+        if real == saved_real and imag == saved_imag:
+            return 0
+        if n == period:
+            period += period
+            saved_real = real
+            saved_imag = imag
+    return 0
+
+
+@njit(cache=True)
+def mandelbrot_single_point_smooth(creal, cimag, maxiter):
+    """
+    as mandelbrot_single_point, but returns the smooth iteration count:
+    n + 1 - log2(log|z|), with an escape radius of 256 to make it accurate
+    """
+    if in_main_bulbs(creal, cimag):
+        return 0.
+    real = creal
+    imag = cimag
+    saved_real = real
+    saved_imag = imag
+    period = 8
+    for n in range(maxiter):
+        real2 = real * real
+        imag2 = imag * imag
+        if real2 + imag2 > 65536.0:
+            return n + 1 - np.log2(0.5 * np.log(real2 + imag2))
+        real_imag = real * imag
+        imag = real_imag + real_imag + cimag
+        real = real2 - imag2 + creal
+        if real == saved_real and imag == saved_imag:
+            return 0.
+        if n == period:
+            period += period
+            saved_real = real
+            saved_imag = imag
+    return 0.
@@ -1,16 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
+from .compiler import compile_art, children, subtrees
+from .randomart import Mix, thumbnail_size, mean_rows, block_sums
 
 
-def get_image(art,size=200):
+def get_image(art,size=200,compiled=True,jit=False,tile_size=None,workers=1,dtype=np.float64,quantization='wrap',
+              memo=False):
+    """
+    render the art
+    :param art: the art (expression tree)
+    :param size: width and height of the image in pixels
+    :param compiled: evaluate a compiled program (see compiler.py) instead of calling art.eval recursively
+    :param jit: render with a numba kernel generated from the art (see jit.py). Much faster for repeated
+    renders of (the structure of) an art, but the first render of a structure takes seconds to compile.
+    :param tile_size: evaluate (the compiled program) in bands of this many rows, so that the memory needed
+    for the evaluation is bounded by the size of a band, rather than of the whole image. Needed for very
+    large images.
+    :param workers: number of threads that render the bands in parallel (numpy releases the GIL),
+    bands of 64 rows are used if no tile_size is given.
+    :param dtype: the float type the art is evaluated in; np.float32 halves the memory (traffic) of the
+    evaluation, but may change some pixels (see precision.py). The jit kernel always uses float64.
+    :param quantization: how the values are mapped to 8 bits, see quantize
+    :param memo: load the outputs of subtrees that were computed before (at the same size and dtype, by this or
+    another art) from a cache, and store the ones that are computed; only when the compiled program is evaluated
+    on the whole image. True for compiler.subtrees, or the LRUCache to use. Off by default: storing the outputs
+    costs a copy and memory, and only pays off when (the subtrees of) the arts are rendered again.
+    :return: PIL image
+    """
 
-    u,v = np.meshgrid(np.linspace(0,1,size),np.linspace(0,1,size))
+    if jit:
+        from .jit import render
+        return Image.fromarray(render(art, size=size, quantization=quantization))
+
+    if workers > 1 or tile_size is not None:
+        rgbArray = np.empty((size, size, 3), 'uint8')
+        render_bands(art, rgbArray, tile_size or 64, workers, dtype, quantization)
+        return Image.fromarray(rgbArray)
+
+    u,v = np.meshgrid(np.linspace(0,1,size,dtype=dtype),np.linspace(0,1,size,dtype=dtype))
     print('evaluating expressions')
-    (r, g, b) = art.eval(u, v)
+    if compiled:
+        if memo is True:
+            memo = subtrees
+        elif memo is False:
+            memo = None
+        (r, g, b) = compile_art(art, memo=memo, size=size, dtype=dtype).run(u, v)
+    else:
+        (r, g, b) = art.eval(u, v)
     print('evaluation done')
-    rgbArray = np.zeros((size, size, 3), 'uint8')
-    rgbArray[..., 0] = r * 256
-    rgbArray[..., 1] = g * 256
-    rgbArray[..., 2] = b * 256
-    img = Image.fromarray(rgbArray)
+    img = Image.fromarray(quantize((r, g, b), mode=quantization))
     return img
+
+
+def get_image_with_thumbnails(art, size=200, thumbnail_size=thumbnail_size, dtype=np.float64, quantization='wrap'):
+    """
+    render the art, and capture the output of each node of the tree while doing so, e.g. for plotting the tree
+    (see treevisualisation.py) without evaluating the nodes once more
+    :param thumbnail_size: the outputs are sampled at every n-th pixel, so that they are at least this size
+    :return: (PIL image, dict with the output (r, g, b) of each node by id of the operator)
+    """
+    u, v = np.meshgrid(np.linspace(0, 1, size, dtype=dtype), np.linspace(0, 1, size, dtype=dtype))
+    thumbnails = {}
+    channels = compile_art(art, nodes=True).run(u, v, capture=thumbnails, step=max(1, size // thumbnail_size))
+    return Image.fromarray(quantize(channels, mode=quantization)), thumbnails
+
+
+def quantize(channels, out=None, mode='wrap'):
+    """
+    map the values of the channels to 8 bits, v -> v * 256, into one interleaved array
+    :param channels: (r, g, b) arrays of the same shape
+    :param out: uint8 array of shape (*shape of a channel, 3), made if not given
+    :param mode: 'wrap': the integer part of v * 256, modulo 256, so that values outside [0, 1) wrap around,
+    e.g. -0.1 becomes 231 (as jit.to_uint8 does). 'clip': clipped to [0, 255]. Nan and inf become 0 in 'wrap' mode,
+    nan becomes 0 in 'clip' mode.
+    :return: out
+    """
+    if mode not in ('wrap', 'clip'):
+        raise ValueError(f"unknown quantization mode {mode}, should be 'wrap' or 'clip'")
+    if out is None:
+        out = np.empty(channels[0].shape + (3,), dtype=np.uint8)
+    # in blocks of rows, so that the buffers stay small
+    tmp = np.empty((64,) + channels[0].shape[1:], dtype=np.result_type(channels[0], np.float32))
+    if mode == 'wrap':
+        atmp = np.empty_like(tmp)
+        mask = np.empty(tmp.shape, dtype=bool)
+        itmp = np.empty(tmp.shape, dtype=np.int64)
+    for start in range(0, channels[0].shape[0], 64):
+        for k, c in enumerate(channels):
+            block = c[start:start + 64]
+            t = tmp[:block.shape[0]]
+            np.multiply(block, 256, out=t)
+            if mode == 'wrap':
+                # the values beyond the int64 range are multiples of 256 (as are inf), and nan is 0
+                a, m, i = atmp[:block.shape[0]], mask[:block.shape[0]], itmp[:block.shape[0]]
+                np.less(np.abs(t, out=a), 2. ** 63, out=m)
+                i.fill(0)
+                np.copyto(i, t, casting='unsafe', where=m)  # the integer part, which is in range
+                np.bitwise_and(i, 255, out=out[start:start + 64, ..., k], casting='unsafe')  # also of negatives
+            else:
+                np.fmax(t, 0, out=t)  # also nan -> 0
+                np.minimum(t, 255, out=t)
+                np.copyto(out[start:start + 64, ..., k], t, casting='unsafe')
+    return out
+
+
+def get_band(axis, start, tile_size):
+    """the coordinate grids of the band of rows that starts at the given row"""
+    return np.meshgrid(axis, axis[start:start + tile_size])
+
+
+def render_bands(art, out, tile_size=64, workers=1, dtype=np.float64, quantization='wrap'):
+    """
+    render the art band by band into out
+    :param out: uint8 array of shape (size, size, 3)
+    :param workers: number of threads that render the bands in parallel
+    :param dtype: the float type the art is evaluated in
+    :param quantization: 'wrap' or 'clip', see quantize
+    """
+    size = out.shape[0]
+    axis = np.linspace(0, 1, size, dtype=dtype)
+    weights = get_mix_weights(art, size, workers, dtype)
+    program = compile_art(art, weights)
+    program.prepare(size, dtype)
+
+    def render_band(start):
+        channels = program.run(*get_band(axis, start, tile_size), size=size, start=start)
+        quantize(channels, out[start:start + tile_size], quantization)
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(render_band, range(0, size, tile_size)))
+
+
+def iter_bands(art, size=200, tile_size=64, dtype=np.float64, quantization='wrap'):
+    """
+    render the art band by band, e.g. to stream a very large image to a file.
+    The fractals (Mandle) are computed for the whole image; they are needed at full size to normalize them.
+    :return: generator of (index of the first row, uint8 array of shape (rows, size, 3)); the array is reused
+    for the next band
+    """
+    axis = np.linspace(0, 1, size, dtype=dtype)
+    weights = get_mix_weights(art, size, dtype=dtype)
+    program = compile_art(art, weights)
+    band = np.empty((tile_size, size, 3), 'uint8')
+    for start in range(0, size, tile_size):
+        u, v = get_band(axis, start, tile_size)
+        rows = u.shape[0]
+        quantize(program.run(u, v, size=size, start=start), band[:rows], quantization)
+        yield start, band[:rows]
+
+
+def get_mix_weights(art, size, workers=1, dtype=np.float64):
+    """
+    compute the weights of the Mix operators (means over the whole image) band by band, in bands of
+    randomart.mean_rows rows, so that the weights are exactly the ones of the evaluation of the whole image
+    :return: dict of weight by id of the Mix operator
+    """
+    axis = np.linspace(0, 1, size, dtype=dtype)
+    weights = {}
+
+    def visit(op, executor):
+        for c in children.get(type(op), ()):
+            visit(getattr(op, c), executor)
+        if type(op) is Mix and id(op) not in weights:
+            # the Mix operators inside w have been visited already
+            program = compile_art(op.w, weights, channels=({'r': 0, 'g': 1, 'b': 2}[op.weighing_color],))
+            program.prepare(size, dtype)
+
+            def band_sums(start):
+                return block_sums(program.run(*get_band(axis, start, mean_rows), size=size, start=start)[0])
+
+            sums = [s for band in executor.map(band_sums, range(0, size, mean_rows)) for s in band]
+            weights[id(op)] = sum(sums) / size ** 2  # as randomart.mean
+
+    with ThreadPoolExecutor(workers) as executor:
+        visit(art, executor)
+    return weights
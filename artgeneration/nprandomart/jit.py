@@ -0,0 +1,199 @@
+"""
+numba backend: renders the art with a per-pixel kernel that is generated from the tree.
+
+Each pixel is computed in registers and written once, as uint8, into the output, instead of evaluating
+every operator as a whole-array numpy pass. The rows of the image are processed in parallel.
+The parameters of the operators are passed to the kernel as an array, so that the compiled kernels can be
+cached by the structure of the tree only: compiling takes a few seconds for a large tree.
+
+Two kinds of operators are evaluated outside of the kernel:
+- the weight of Mix, which is the mean over the whole image of one of the channels of its w expression
+- operators the kernel generator does not know (i.e. Mandle), which are evaluated with their own eval,
+  their output is passed to the kernel as arrays.
+"""
+
+import math
+import threading
+import numpy as np
+from numba import njit, prange, types
+from .randomart import VariableX, VariableY, Constant, Average, Product, Mod, Well, Tent, Sin, Level, Mix, mean
+from .compiler import compile_art
+from .cache import LRUCache
+from . import fractal  # starts numba's threads, see there
+
+# compiled kernels, by source code (which depends on the structure of the tree only); every structure that is
+# rendered adds one, so only the most recently used are kept (the count is bounded, a kernel counts as 1 'byte').
+# Nothing else references a kernel, see get_kernel.
+kernels = LRUCache(max_bytes=64, sizeof=lambda kernel: 1)
+kernels_lock = threading.Lock()  # so that a kernel is compiled once, see get_kernel
+
+
+@njit(cache=True)
+def to_uint8(v):
+    """the wrapping conversion of quantize(..., mode='wrap'); beyond the int64 range v * 256 is a multiple of 256"""
+    v = v * 256
+    if not -9.2e18 < v < 9.2e18:  # nan, inf and out of int64 range
+        return np.uint8(0)
+    return np.uint8(np.int64(v) & 255)
+
+
+@njit(cache=True)
+def to_uint8_clipped(v):
+    """the clipped conversion of quantize(..., mode='clip')"""
+    v = v * 256
+    if not v > 0:  # also nan
+        return np.uint8(0)
+    if v >= 255:
+        return np.uint8(255)
+    return np.uint8(v)
+
+
+# the branches are kept out of the kernel; many basic blocks make its compilation very slow
+
+@njit(cache=True)
+def mod(a, b):
+    if b > 0:
+        return a % b
+    return 0.
+
+
+@njit(cache=True)
+def level(level, treshold, a, b):
+    if level < treshold:
+        return a
+    return b
+
+
+class _KernelSource:
+    """generates the source code of the kernel, and collects the parameters and the leaf arrays"""
+
+    def __init__(self, axis):
+        self.axis = axis
+        self.xy = None  # the coordinate grids, only made when needed for evaluations outside of the kernel
+        self.lines = []
+        self.params = []
+        self.leaves = []
+        self.n_names = 0
+        self.names = {}
+
+    def param(self, value):
+        self.params.append(value)
+        return f'p[{len(self.params) - 1}]'
+
+    def assign(self, expression):
+        name = f'v{self.n_names}'
+        self.n_names += 1
+        self.lines.append(f'{name} = {expression}')
+        return name
+
+    def lower(self, op, channel):
+        """return the name of the local variable holding the given channel of the output of op"""
+        key = (id(op), channel)
+        if key not in self.names:
+            self.names[key] = self._lower(op, channel)
+        return self.names[key]
+
+    def _lower(self, op, channel):
+        cls = type(op)
+        if cls is VariableX:
+            return 'x'
+        if cls is VariableY:
+            return 'y'
+        if cls is Constant:
+            return self.param((op.c1, op.c2, op.c3)[channel])
+        if cls in (Average, Product, Mod):
+            a, b = self.lower(op.e1, channel), self.lower(op.e2, channel)
+            if cls is Average:
+                return self.assign(f'0.5 * {a} + 0.5 * {b}')
+            if cls is Product:
+                return self.assign(f'{a} * {b}')
+            return self.assign(f'mod({a}, {b})')
+        if cls in (Well, Tent, Sin):
+            a = self.lower(op.e, channel)
+            if cls is Well:
+                return self.assign(f'1 - 2 / (1 + {a} * {a}) ** 8')
+            if cls is Tent:
+                return self.assign(f'1 - 2 * abs({a})')
+            return self.assign(f'math.sin({self.param(op.phase)} + {self.param(op.freq)} * {a})')
+        if cls is Level:
+            level, a, b = (self.lower(e, channel) for e in (op.level, op.e1, op.e2))
+            return self.assign(f'level({level}, {self.param(op.treshold)}, {a}, {b})')
+        if cls is Mix:
+            a, b = self.lower(op.e1, channel), self.lower(op.e2, channel)
+            key = (id(op), 'w')
+            if key not in self.names:
+                self.names[key] = self.param(self.weight(op))
+            w = self.names[key]
+            return self.assign(f'{w} * {a} + (1 - {w}) * {b}')
+
+        # evaluated outside of the kernel
+        key = (id(op), 'leaf')
+        if key not in self.names:
+            self.names[key] = len(self.leaves)
+            self.leaves.extend(np.ascontiguousarray(c, dtype=np.float64) for c in op.eval(*self.grid()))
+        return f'leaves[{self.names[key] + channel}][i, j]'
+
+    def grid(self):
+        if self.xy is None:
+            self.xy = np.meshgrid(self.axis, self.axis)
+        return self.xy
+
+    def weight(self, op):
+        w = compile_art(op.w).run(*self.grid())[{'r': 0, 'g': 1, 'b': 2}[op.weighing_color]]
+        return mean(w)
+
+    def source(self, outputs, quantization='wrap'):
+        body = '\n'.join(' ' * 4 + line for line in self.lines)
+        convert = {'wrap': 'to_uint8', 'clip': 'to_uint8_clipped'}[quantization]
+        return f"""
+def pixel(x, y, p, leaves, i, j):
+{body}
+    return {convert}({outputs[0]}), {convert}({outputs[1]}), {convert}({outputs[2]})
+
+def fill(xs, ys, p, leaves, out):
+    for i in prange(ys.shape[0]):
+        y = ys[i]
+        for j in range(xs.shape[0]):
+            out[i, j, 0], out[i, j, 1], out[i, j, 2] = pixel(xs[j], y, p, leaves, i, j)
+"""
+
+
+def get_kernel(source, n_leaves):
+    """
+    return the compiled kernel for the given source, compile it if it is not in the cache.
+    The kernel is the fill function of the source, which evaluates the pixel function for all pixels. Both are
+    compiled together, and only referenced by the cache, so that evicting a kernel frees all of its machine code.
+    :param n_leaves: number of leaf arrays the kernel takes, to compile it eagerly (under the lock, so once)
+    """
+    with kernels_lock:
+        kernel = kernels.get(source)
+        if kernel is not None:
+            return kernel
+        namespace = {'math': math, 'prange': prange, 'to_uint8': to_uint8, 'to_uint8_clipped': to_uint8_clipped,
+                     'mod': mod, 'level': level}
+        exec(source, namespace)
+        namespace['pixel'] = njit(namespace['pixel'])
+        vector = types.float64[::1]
+        signature = (vector, vector, vector, types.UniTuple(types.float64[:, ::1], n_leaves), types.uint8[:, :, ::1])
+        kernel = njit(signature, parallel=True)(namespace['fill'])  # not cached on disk, it is generated
+        kernels.put(source, kernel)
+        return kernel
+
+
+def render(art, size=200, quantization='wrap'):
+    """
+    render the art with a numba kernel
+    :param art: the art (expression tree)
+    :param size: width and height of the image in pixels
+    :param quantization: 'wrap' or 'clip', as in image.quantize
+    :return: uint8 array of shape (size, size, 3)
+    """
+    axis = np.linspace(0, 1, size)
+    kernel_source = _KernelSource(axis)
+    outputs = [kernel_source.lower(art, c) for c in range(3)]
+    leaves = tuple(kernel_source.leaves) or (np.zeros((1, 1)),)  # numba cannot type an empty tuple of arrays
+    kernel = get_kernel(kernel_source.source(outputs, quantization), len(leaves))
+
+    out = np.empty((size, size, 3), dtype=np.uint8)
+    kernel(axis, axis, np.array(kernel_source.params, dtype=np.float64), leaves, out)
+    return out
@@ -0,0 +1,110 @@
+"""
+the art (expression tree) as a plain tree of nodes, and its layout, for drawing it (see treevisualisation.py).
+Each node is visited once, so the layout takes linear time in the number of nodes.
+"""
+
+from .compiler import children
+
+
+class Node:
+    __slots__ = ('name', 'children', 'image')
+
+    def __init__(self, name='', children=(), image=None):
+        self.name = name
+        self.children = list(children)
+        self.image = image
+
+    def is_leaf(self):
+        return not self.children
+
+    def traverse(self):
+        """the nodes in preorder"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def get_leaves(self):
+        return [node for node in self.traverse() if node.is_leaf()]
+
+
+def get_tree(art, images=None, name=str):
+    """
+    :param art: the root Operator
+    :param images: the image of each operator, by id of the operator (see image.get_image_with_thumbnails)
+    :param name: function that gives the name of a node from its operator
+    :return: the root Node; the w expressions of Mix operators are left out
+    """
+    def visit(op):
+        return Node(name(op),
+                    [visit(getattr(op, c)) for c in children.get(type(op), ()) if c != 'w'],
+                    images[id(op)] if images is not None else None)
+
+    return visit(art)
+
+
+def get_layout(tree):
+    """
+    the layout of the tree from left (root) to right (leaves), as in Francois Serra's script
+    (https://gist.github.com/fransua/da703c3d2ba121903c0de5e976838b71):
+    x is the depth of the node, starting at 1 for the root, y the position of the leaves, the first leaf
+    at the top (highest y), and a node in the middle of its children
+    :return: (a dictionary of nodes with their coordinates, the horizontal lines, the vertical lines),
+    lines as ((x1, y1), (x2, y2)); the horizontal lines include one into the root
+    """
+    coords = {}
+    hlines = []
+    vlines = []
+    n_leaves = len(tree.get_leaves())
+    leaves = iter(range(n_leaves - 1, -1, -1))
+
+    def place(node, x):
+        if node.is_leaf():
+            y = next(leaves)
+        else:
+            ys = [place(child, x + 1) for child in node.children]
+            y = sum(ys) / len(ys)
+            vlines.append(((x, ys[0]), (x, ys[-1])))
+        hlines.append(((x - 1, y), (x, y)))
+        coords[node] = (x, y)
+        return y
+
+    place(tree, 1)
+    return coords, hlines, vlines
+
+
+def get_ascii(tree):
+    """
+    draw the tree with ascii characters, every node on a line of its own (as ete3's Tree.get_ascii does)
+    :return: str
+    """
+    def draw(node, char1='-'):
+        """:return: the lines, and the index of the line of the node"""
+        if node.is_leaf():
+            return [char1 + '-' + node.name], 0
+        width = max(3, len(node.name))
+        lines = []
+        mids = []
+        for child in node.children:
+            if child is node.children[0]:
+                char2 = '/'
+            elif child is node.children[-1]:
+                char2 = '\\'
+            else:
+                char2 = '-'
+            child_lines, mid = draw(child, char2)
+            mids.append(mid + len(lines))
+            lines.extend(child_lines)
+            lines.append('')
+        lines.pop()
+        lo, hi, end = mids[0], mids[-1], len(lines)
+        prefixes = [' ' * width] * (lo + 1) + [' ' * (width - 1) + '|'] * (hi - lo - 1) + [' ' * width] * (end - hi)
+        mid = (lo + hi) // 2
+        prefixes[mid] = char1 + '-' * (width - 2) + prefixes[mid][-1]
+        lines = [p + line for p, line in zip(prefixes, lines)]
+        stem = lines[mid]
+        lines[mid] = stem[0] + node.name + stem[len(node.name) + 1:]
+        return lines, mid
+
+    return '\n' + '\n'.join(draw(tree)[0])
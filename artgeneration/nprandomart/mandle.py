@@ -2,49 +2,62 @@
 fast mandlebrot set calculation.
 """
 
-from numba import njit
 import numpy as np
 from pathlib import Path
+from functools import lru_cache
 import json, random
-from .randomart import Operator, store
+from .randomart import Operator
+from .cache import LRUCache
 this_dir = Path(__file__).parent
-# load list of interesting mandlebrot locations,
-# courtesy of David Eck: http://math.hws.edu/eck/js/mandelbrot/java/MandelbrotSettings/
-with open(this_dir / 'resources/mandle_locations.json') as f:
-    locations = json.load(f)['locations']
-    locations = [loc for loc in locations if loc['max_iterations'] <= 5000]
+
+max_iterations = 5000  # of the locations that are used, deeper ones take too long to compute
+
+
+@lru_cache(maxsize=None)
+def get_locations():
+    """
+    the list of interesting mandlebrot locations, loaded on first use,
+    courtesy of David Eck: http://math.hws.edu/eck/js/mandelbrot/java/MandelbrotSettings/
+    :return: float64 array with a row (xmin, xmax, ymin, ymax, max_iterations) per location
+    """
+    with open(this_dir / 'resources/mandle_locations.json') as f:
+        locations = json.load(f)['locations']
+    return np.array([[loc['limits'][k] for k in ('xmin', 'xmax', 'ymin', 'ymax')] + [loc['max_iterations']]
+                     for loc in locations if loc['max_iterations'] <= max_iterations])
+
+
+# computed fractals, by (xmin, xmax, ymin, ymax, maxiter, size), shared by all arts (and threads) in the process
+fractals = LRUCache(max_bytes=512e6)
 
 
 class Mandle(Operator):
     arity = 0
 
     @classmethod
-    def setup(cls):
-        cls.set_random_location()
+    def setup(cls, rng=random):
+        cls.set_random_location(rng)
 
     @classmethod
-    def set_random_location(cls):
-
-        cls.cache = {}  # cache to store evaluations, as this is a very expensive function
+    def set_random_location(cls, rng=random):
+        """set the location for the Mandle operators that are created next"""
 
-        location = random.choice(locations)
-        cls.xmin = location['limits']['xmin']
-        cls.xmax = location['limits']['xmax']
-        cls.ymin = location['limits']['ymin']
-        cls.ymax = location['limits']['ymax']
+        location = rng.choice(get_locations())
+        cls.xmin, cls.xmax, cls.ymin, cls.ymax = (float(v) for v in location[:4])
 
         # shift locations a bit, otherwise would not be random
-        x_shift = random.uniform(-0.4, 0.4) * (cls.xmax - cls.xmin)
+        x_shift = rng.uniform(-0.4, 0.4) * (cls.xmax - cls.xmin)
         cls.xmin += x_shift
         cls.xmax += x_shift
-        y_shift = random.uniform(-0.4, 0.4) * (cls.ymax - cls.ymin)
+        y_shift = rng.uniform(-0.4, 0.4) * (cls.ymax - cls.ymin)
         cls.ymin += y_shift
         cls.ymax += y_shift
 
-        cls.maxiter = location['max_iterations']
+        cls.maxiter = int(location[4])
 
-    def __init__(self):
-        pass
+    def __init__(self, rng=random):
+        for k in ['xmin', 'xmax', 'ymin', 'ymax', 'maxiter']:
+            setattr(self, k, getattr(self.__class__, k))
+        self.normalize_to_one = rng.choice([True, False, False]) # when not normalizing, it gives nice glitchy effects
 
     def __repr__(self):
         return "Mandlebrot"
@@ -53,81 +66,53 @@ class Mandle(Operator):
         """
         Custom getstate for to give desired encode behavior when using jsonpickle
         """
-        state = {k: getattr(self, k) for k in ['xmin', 'xmax', 'ymin', 'ymax', 'maxiter']}
+        state = {k: getattr(self, k) for k in ['xmin', 'xmax', 'ymin', 'ymax', 'maxiter', 'normalize_to_one']}
         return state
 
     def __setstate__(self, state):
         """
         Custom getstate for to give desired decode behavior when using jsonpickle
         """
-        self.__class__.cache = {}
+        self.normalize_to_one = False  # trees stored before normalize_to_one was part of the state
         for k, v in state.items():
             setattr(self, k, v)
 
-    @store
     def eval(self, x, y):
-
-        size = x.shape[0]  # i.e. 900 pixels
-        try:
-            mandle = self.cache[size]
-        except KeyError:
-            mandle = get_mandlebrot(self.xmin,
-                                    self.xmax,
-                                    self.ymin,
-                                    self.ymax,
-                                    size=size,
-                                    maxiter=self.maxiter)
-
-            normalize_to_one = random.choice([True, False, False]) # when not normalizing, it gives nice glitchy effects
-            if normalize_to_one:
-                mandle = mandle / mandle.max()
-            self.cache[size] = mandle
-
+        mandle = self.get_fractal(x.shape[0], x.dtype)  # i.e. 900 pixels
         return (mandle, mandle, mandle)
 
+    def get_fractal(self, size, dtype=np.float64):
+        """
+        return the (size, size) image of the fractal
+        :param dtype: the float type of the image; the fractal itself is always computed in float64,
+        the locations are too deep zooms for float32
+        """
+        key = (self.xmin, self.xmax, self.ymin, self.ymax, self.maxiter, size)
+        if np.dtype(dtype) != np.float64:
+            key += ('normalized',) if self.normalize_to_one else ()
+            return fractals.get_or_compute(key + (np.dtype(dtype).name,),
+                                           lambda: self.get_fractal(size).astype(dtype))
 
+        mandle = fractals.get_or_compute(key, lambda: get_mandlebrot(self.xmin,
+                                                                     self.xmax,
+                                                                     self.ymin,
+                                                                     self.ymax,
+                                                                     size=size,
+                                                                     maxiter=self.maxiter))
+        if self.normalize_to_one:
+            mandle = fractals.get_or_compute(key + ('normalized',), lambda: mandle / mandle.max())
 
-@njit
-def get_mandlebrot(xmin, xmax, ymin, ymax, size, maxiter):
-    """
-    fast, numba-based mandlebrot set calculation
-    :return:
-    """
-    print('starting mandlebrot set calculation')
-    real_axis = np.linspace(xmin, xmax, size)
-    imag_axis = np.linspace(ymin, ymax, size)
-    mandle = np.empty((size, size))
-    for i in range(size):
-        for j in range(size):
-            mandle[i, j] = mandelbrot_single_point(real_axis[i], imag_axis[j], maxiter)
+        return mandle
 
-    print('finished mandlebrot set calculation')
-    return mandle
 
-
-@njit
-def mandelbrot_single_point(creal, cimag, maxiter):
+def get_mandlebrot(xmin, xmax, ymin, ymax, size, maxiter, dtype=np.float64, smooth=False):
     """
-    largely based on http://numba.pydata.org/numba-doc/0.21.0/user/examples.html
-    plus added further optimizations:
-    make the code run faster by avoiding a square root computation when
-    computing np.abs(z) > 2 .  We can get an equivalent condition by squaring both sides, which yields:
-    z.real * z.real + z.imag * z.imag > 4
-    We can do even better, by breaking the complex number into its constituents.
-    :param creal:
-    :param cimag:
-    :param maxiter:
-    :return:
+    fast, numba-based mandlebrot set calculation
+    :param dtype: np.float64, or np.float32 for a faster calculation; float32 can only resolve shallow zooms.
+    :param smooth: return the smooth (continuous) iteration count instead of the number of iterations
+    :return: array of shape (size, size), the first axis is the real axis. Points in the set are 0.
     """
-    real = creal
-    imag = cimag
-    for n in range(maxiter):
-        real2 = real * real
-        imag2 = imag * imag
-        if real2 + imag2 > 4.0:
-            return n
-        imag = 2 * real * imag + cimag
-        real = real2 - imag2 + creal
-    return 0
-
-
+    from .fractal import mandlebrot_grid  # numba is imported, and the kernel compiled (or loaded), on first use
+    real_axis = np.linspace(xmin, xmax, size).astype(dtype)
+    imag_axis = np.linspace(ymin, ymax, size).astype(dtype)
+    return mandlebrot_grid(real_axis, imag_axis, maxiter, smooth)
@@ -0,0 +1,84 @@
+"""
+validation of the float32 evaluation (get_image(..., dtype=np.float32)) against float64.
+
+Every node of the tree is evaluated in both float types, and its output is quantized to 8 bits as in the image.
+A node diverges when too many of its pixels differ (by more than one level); the divergence is attributed
+to the operators whose output diverges while none of their inputs do, i.e. where the difference arises.
+Operators that amplify small differences (Mod, the treshold of Level, the frequency of Sin) are the usual suspects.
+
+usage: python -m nprandomart.precision [number of arts] [size]
+"""
+
+import sys
+from collections import defaultdict
+import numpy as np
+from .compiler import children
+from . import image
+from .randomart import get_art
+
+
+def quantize(c):
+    """the 8 bit value of each pixel, as in get_image"""
+    out = np.empty(c.shape + (1,), dtype=np.uint8)
+    return image.quantize((c,), out)[..., 0].astype(np.int64)
+
+
+def get_difference(c32, c64):
+    """the fraction of pixels that differ by more than one level (the 8 bit values wrap around)"""
+    d = np.abs(quantize(c32) - quantize(c64))
+    return np.mean(np.minimum(d, 256 - d) > 1)
+
+
+def compare_art(art, size=100, treshold=0.001):
+    """
+    :param treshold: the fraction of pixels that may differ before a node counts as diverging
+    :return: dict with the difference of the whole image, and a list of (operator, difference, introduced)
+    for all nodes; introduced is True when the inputs of the node do not diverge
+    """
+    grids = {dtype: np.meshgrid(np.linspace(0, 1, size, dtype=dtype), np.linspace(0, 1, size, dtype=dtype))
+             for dtype in (np.float32, np.float64)}
+    nodes = []
+
+    def visit(op):
+        inputs_diverge = [visit(getattr(op, c)) for c in children.get(type(op), ())]
+        difference = max(get_difference(c32, c64) for c32, c64 in zip(op.eval(*grids[np.float32]),
+                                                                       op.eval(*grids[np.float64])))
+        diverges = difference > treshold
+        nodes.append((type(op).__name__, difference, diverges and not any(inputs_diverge)))
+        return diverges
+
+    visit(art)
+    return {'difference': nodes[-1][1], 'nodes': nodes}
+
+
+def compare_arts(arts, size=100, treshold=0.001):
+    """
+    compare float32 with float64 for a corpus of arts
+    :return: dict with the differences of the images, and per operator: the number of nodes,
+    the number of nodes where a divergence was introduced, and the largest difference there
+    """
+    operators = defaultdict(lambda: {'nodes': 0, 'introduced': 0, 'max_difference': 0.})
+    differences = []
+    for art in arts:
+        result = compare_art(art, size, treshold)
+        differences.append(result['difference'])
+        for name, difference, introduced in result['nodes']:
+            stats = operators[name]
+            stats['nodes'] += 1
+            if introduced:
+                stats['introduced'] += 1
+                stats['max_difference'] = max(stats['max_difference'], difference)
+    return {'differences': differences, 'operators': dict(operators)}
+
+
+if __name__ == '__main__':
+    n_arts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    result = compare_arts((get_art(seed=seed) for seed in range(n_arts)), size)
+    differences = np.array(result['differences'])
+    print(f'{n_arts} arts of {size}x{size} pixels, fraction of differing pixels: '
+          f'median {np.median(differences):.4f}, max {differences.max():.4f}, '
+          f'arts with more than 1%: {np.sum(differences > 0.01)}')
+    print(f'{"operator":<12}{"nodes":>8}{"diverging":>12}{"max difference":>16}')
+    for name, stats in sorted(result['operators'].items(), key=lambda item: -item[1]['introduced']):
+        print(f'{name:<12}{stats["nodes"]:>8}{stats["introduced"]:>12}{stats["max_difference"]:>16.4f}')
@@ -4,11 +4,12 @@
 
 
 import random
+import threading
 import numpy as np
 from copy import copy
 
 
-np.seterr(divide='ignore', invalid='ignore')
+np.seterr(divide='ignore', invalid='ignore', over='ignore')  # e.g. well overflows (to 1) in float32
 thumbnail_size = 200
 
 # Utility functions
@@ -22,6 +23,21 @@ def average(c1, c2, w=0.5):
     return (r3, g3, b3)
 
 
+# the mean that is the weight of Mix is summed in blocks of this many rows, then over the blocks, so that it can
+# be computed band by band (see image.get_mix_weights) with exactly the same result as over the whole image
+mean_rows = 64
+
+
+def block_sums(a):
+    """the sums of the blocks of mean_rows rows of the (contiguous) array"""
+    return [np.sum(a[i:i + mean_rows]) for i in range(0, a.shape[0], mean_rows)]
+
+
+def mean(a):
+    """the mean of the (contiguous) array, in the float type of the array, from the sums of its blocks"""
+    return sum(block_sums(a)) / a.size
+
+
 def well(x):
     """A function which looks a bit like a well."""
     return 1 - 2 / (1 + x * x) ** 8
@@ -52,59 +68,41 @@ class Operator:
         raise NotImplementedError
 
     def __getstate__(self):
-        """custom getstate for jsonpickle"""
-        return {k: v for k, v in self.__dict__.items() if k not in ['img']}
-
-
-def store(eval_original):
-    """
-    decorator that stores the image for each operator
-    """
-
-    def eval_with_storage(*args):
-        instance = args[0]
-        img = eval_original(*args)
-        if img[0].shape[0] <= thumbnail_size:  # only if thumbnail; storing for full size image would take too much mem
-            instance.img = img
-        return img
-
-    return eval_with_storage
+        """custom getstate for jsonpickle; keeps the format (py/state) of the trees that were stored before"""
+        return dict(self.__dict__)
 
 
 class VariableX(Operator):
     arity = 0
 
-    def __init__(self): pass
+    def __init__(self, rng=random): pass
 
     def __repr__(self): return "ReturnX(X,Y)"
 
-    @store
     def eval(self, x, y): return (x, x, x)
 
 
 class VariableY(Operator):
     arity = 0
 
-    def __init__(self): pass
+    def __init__(self, rng=random): pass
 
     def __repr__(self): return "ReturnY(X,Y)"
 
-    @store
     def eval(self, x, y): return (y, y, y)
 
 
 class Constant(Operator):
     arity = 0
 
-    def __init__(self):
-        self.c1 = random.uniform(0, 1)
-        self.c2 = random.uniform(0, 1)
-        self.c3 = random.uniform(0, 1)
+    def __init__(self, rng=random):
+        self.c1 = rng.uniform(0, 1)
+        self.c2 = rng.uniform(0, 1)
+        self.c3 = rng.uniform(0, 1)
 
     def __repr__(self):
         return f'ConstantColor'  # (r={self.c1:.2f},g={self.c2:.2f},b={self.c3:.2f})'
 
-    @store
     def eval(self, x, y): return (np.ones_like(x) * self.c1,
                                   np.ones_like(x) * self.c2,
                                   np.ones_like(x) * self.c3)
@@ -116,14 +114,13 @@ from .mandle import Mandle
 class Average(Operator):
     arity = 2
 
-    def __init__(self, e1, e2):
+    def __init__(self, e1, e2, rng=random):
         self.e1 = e1
         self.e2 = e2
 
     def __repr__(self):
         return 'Average(E1,E2)'
 
-    @store
     def eval(self, x, y):
         return average(self.e1.eval(x, y), self.e2.eval(x, y))
 
@@ -131,14 +128,13 @@ class Average(Operator):
 class Product(Operator):
     arity = 2
 
-    def __init__(self, e1, e2):
+    def __init__(self, e1, e2, rng=random):
         self.e1 = e1
         self.e2 = e2
 
     def __repr__(self):
         return 'Product(E1,E2)'
 
-    @store
     def eval(self, x, y):
         (r1, g1, b1) = self.e1.eval(x, y)
         (r2, g2, b2) = self.e2.eval(x, y)
@@ -151,14 +147,13 @@ class Product(Operator):
 class Mod(Operator):
     arity = 2
 
-    def __init__(self, e1, e2):
+    def __init__(self, e1, e2, rng=random):
         self.e1 = e1
         self.e2 = e2
 
     def __repr__(self):
         return 'Modulo(E1,E2)'
 
-    @store
     def eval(self, x, y):
         (r1, g1, b1) = self.e1.eval(x, y)
         (r2, g2, b2) = self.e2.eval(x, y)
@@ -174,13 +169,12 @@ class Mod(Operator):
 class Well(Operator):
     arity = 1
 
-    def __init__(self, e):
+    def __init__(self, e, rng=random):
         self.e = e
 
     def __repr__(self):
         return 'WellFunction(E1)'
 
-    @store
     def eval(self, x, y):
         (r, g, b) = self.e.eval(x, y)
         return (well(r), well(g), well(b))
@@ -189,13 +183,12 @@ class Well(Operator):
 class Tent(Operator):
     arity = 1
 
-    def __init__(self, e):
+    def __init__(self, e, rng=random):
         self.e = e
 
     def __repr__(self):
         return 'TentFunction(E1)'
 
-    @store
     def eval(self, x, y):
         (r, g, b) = self.e.eval(x, y)
         return (tent(r), tent(g), tent(b))
@@ -204,15 +197,14 @@ class Tent(Operator):
 class Sin(Operator):
     arity = 1
 
-    def __init__(self, e):
+    def __init__(self, e, rng=random):
         self.e = e
-        self.phase = random.uniform(0, np.pi)
-        self.freq = random.uniform(1.0, 6.0)
+        self.phase = rng.uniform(0, np.pi)
+        self.freq = rng.uniform(1.0, 6.0)
 
     def __repr__(self):
         return f'Sine(E1)(phase={self.phase:.2f},freq={self.freq:.2f})'
 
-    @store
     def eval(self, x, y):
         (r1, g1, b1) = self.e.eval(x, y)
         r2 = np.sin(self.phase + self.freq * r1)
@@ -224,8 +216,8 @@ class Sin(Operator):
 class Level(Operator):
     arity = 3
 
-    def __init__(self, level, e1, e2):
-        self.treshold = random.uniform(-1.0, 1.0)
+    def __init__(self, level, e1, e2, rng=random):
+        self.treshold = rng.uniform(-1.0, 1.0)
         self.level = level
         self.e1 = e1
         self.e2 = e2
@@ -233,7 +225,6 @@ class Level(Operator):
     def __repr__(self):
         return f'Level(E1,E2,E3)(treshold={self.treshold:.2f})'
 
-    @store
     def eval(self, x, y):
         (r1, g1, b1) = self.level.eval(x, y)
         (r2, g2, b2) = self.e1.eval(x, y)
@@ -247,19 +238,18 @@ class Level(Operator):
 class Mix(Operator):
     arity = 3
 
-    def __init__(self, w, e1, e2):
+    def __init__(self, w, e1, e2, rng=random):
         self.w = w
         self.e1 = e1
         self.e2 = e2
-        self.weighing_color = random.choice(['r','g','b'])
+        self.weighing_color = rng.choice(['r','g','b'])
 
     def __repr__(self):
         return 'Mix(E1,E2)'
 
-    @store
     def eval(self, x, y):
         color_index = {'r':0,'g':1,'b':2}[self.weighing_color]
-        w = np.mean(self.w.eval(x,y)[color_index])
+        w = mean(self.w.eval(x,y)[color_index])
         c1 = self.e1.eval(x, y)
         c2 = self.e2.eval(x, y)
         return average(c1, c2, w)
@@ -271,8 +261,9 @@ class Mix(Operator):
 operators = [VariableX, VariableY, Constant, Average, Product, Mod, Sin, Tent, Well, Level, Mix]
 
 
-def generate(k=50, operators=operators):
-    '''Randonly generate an expession of a given size.'''
+def generate(k=50, operators=operators, rng=random):
+    '''Randonly generate an expession of a given size.
+    rng: the random number generator to use; the random module or a random.Random instance'''
 
     # We precompute those operators that have arity 0 and arity > 0
     operators0 = [op for op in operators if op.arity == 0]
@@ -280,28 +271,45 @@ def generate(k=50, operators=operators):
 
     if k <= 0:
         # We used up available size, generate a leaf of the expression tree
-        op = random.choice(operators0)
-        return op()
+        op = rng.choice(operators0)
+        return op(rng=rng)
     else:
         # randomly pick an operator whose arity > 0
-        op = random.choice(operators1)
+        op = rng.choice(operators1)
         # generate subexpressions
         i = 0  # the amount of available size used up so far
         args = []  # the list of generated subexpression
-        for j in sorted([random.randrange(k) for l in range(op.arity - 1)]):
-            args.append(generate(j - i,operators))
+        for j in sorted([rng.randrange(k) for l in range(op.arity - 1)]):
+            args.append(generate(j - i,operators,rng))
             i = j
-        args.append(generate(k - 1 - i,operators))
-        return op(*args)
+        args.append(generate(k - 1 - i,operators,rng))
+        return op(*args, rng=rng)
+
+
+# Mandle operators take their location from the class (see Mandle.setup), so arts are generated one at a time
+generation_lock = threading.Lock()
 
 
-def get_art(min_arity=20, max_arity=150, operators=operators):
-    operators_this_art = copy(operators)
-    include_fractal = random.choice([True, True, False])  # prevent fractal overdose, sometimes one without
-    if include_fractal:
-        Mandle.setup()
-        operators_this_art.append(Mandle)
+def get_art(min_arity=20, max_arity=150, operators=operators, seed=None):
+    """
+    generate an art (expression tree)
+    :param seed: the same seed (e.g. an int or str) always gives the same art, also a random.Random instance
+    can be passed. If None, the random module is used.
+    """
+    if seed is None:
+        rng = random
+    elif isinstance(seed, random.Random):
+        rng = seed
+    else:
+        rng = random.Random(seed)
+
+    with generation_lock:
+        operators_this_art = copy(operators)
+        include_fractal = rng.choice([True, True, False])  # prevent fractal overdose, sometimes one without
+        if include_fractal:
+            Mandle.setup(rng)
+            operators_this_art.append(Mandle)
 
-    # generate operator tree
-    art = generate(random.randrange(min_arity, max_arity), operators=operators_this_art)
+        # generate operator tree
+        art = generate(rng.randrange(min_arity, max_arity), operators=operators_this_art, rng=rng)
     return art
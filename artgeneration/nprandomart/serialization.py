@@ -0,0 +1,189 @@
+"""
+compact binary serialization of the art (expression tree).
+
+The format is a header (magic, version, number of nodes), followed by the opcodes of the nodes in preorder
+(one byte each) and the parameters of the nodes, in the same order, as little endian float64. The structure
+of the tree follows from the arity of the operators, so no references between the nodes are stored.
+
+from_jsonpickle converts the json (as made by jsonpickle) of an art, without importing or calling anything
+else than the known operators. Both decoders limit the number of nodes and the depth of the tree, as the data
+may come from an upload.
+
+structural_hash is a hash of the encoding, so it is the same for identical trees, however they were made.
+"""
+
+import hashlib
+import json
+import struct
+import sys
+from array import array
+from .randomart import VariableX, VariableY, Constant, Average, Product, Mod, Well, Tent, Sin, Level, Mix
+from .mandle import Mandle, max_iterations
+from .compiler import children, parameters
+
+magic = b'NPRA'
+version = 1
+header = struct.Struct('<4sBI')  # magic, version, number of nodes
+
+# the opcode of an operator is its index in this tuple; only append to it, existing data depends on the order
+operators = (VariableX, VariableY, Constant, Average, Product, Mod, Well, Tent, Sin, Level, Mix, Mandle)
+opcodes = {cls: i for i, cls in enumerate(operators)}
+
+colors = 'rgb'
+
+
+def _color_index(color):
+    if color not in tuple(colors):
+        raise ValueError(f'invalid art: unknown color {color!r}')
+    return colors.index(color)
+
+
+def _color(index):
+    if index not in (0, 1, 2):
+        raise ValueError(f'invalid art: unknown color index {index!r}')
+    return colors[int(index)]
+
+
+def _maxiter(value):
+    if not 1 <= value <= max_iterations:  # also nan; more iterations would make the render hang
+        raise ValueError(f'invalid art: maxiter {value!r} is not in [1, {max_iterations}]')
+    return int(value)
+
+
+# conversion of the parameters that are not floats, which also checks their range
+_to_float = {'weighing_color': _color_index}
+_from_float = {'weighing_color': _color, 'maxiter': _maxiter, 'normalize_to_one': bool}
+
+# parameters that are missing in older files
+_defaults = {'normalize_to_one': False}
+
+# limits of the decoded trees; the generated arts have hundreds of nodes, and a depth of less than 30.
+# The web app handles trees recursively (e.g. jsonpickle.encode fails from a depth of about 100 on)
+max_nodes = 100000
+max_depth = 64
+
+
+def encode(art, max_nodes=max_nodes):
+    """
+    :param art: the root Operator of the tree
+    :param max_nodes: larger trees are rejected, which also stops the encoding of a cyclic one
+    :return: bytes
+    """
+    ops = bytearray()
+    params = array('d')
+    stack = [art]
+    while stack:
+        op = stack.pop()
+        cls = type(op)
+        try:
+            ops.append(opcodes[cls])
+        except KeyError:
+            raise ValueError(f'cannot serialize operator {cls.__name__}') from None
+        if len(ops) > max_nodes:
+            raise ValueError(f'cannot serialize more than {max_nodes} nodes, or a cyclic tree')
+        params.extend(_to_float.get(p, float)(getattr(op, p)) for p in parameters.get(cls, ()))
+        stack.extend(getattr(op, c) for c in reversed(children[cls]))
+    if sys.byteorder == 'big':
+        params.byteswap()
+    return header.pack(magic, version, len(ops)) + bytes(ops) + params.tobytes()
+
+
+def structural_hash(art):
+    """
+    hash of the structure of the art: the operators, their parameters and the order of their children.
+    Identical trees, e.g. the art of the same seed or an uploaded copy, have the same hash.
+    :return: str of 32 hex digits
+    """
+    return hashlib.blake2b(encode(art), digest_size=16).hexdigest()
+
+
+def decode(data, max_nodes=max_nodes, max_depth=max_depth):
+    """
+    :param data: bytes, as made by encode
+    :param max_nodes: larger trees are rejected
+    :param max_depth: deeper trees are rejected
+    :return: the root Operator of the tree
+    """
+    if len(data) < header.size:
+        raise ValueError('invalid art: too short')
+    magic_, version_, n_nodes = header.unpack_from(data)
+    if magic_ != magic:
+        raise ValueError('invalid art: not an art')
+    if version_ != version:
+        raise ValueError(f'invalid art: unsupported version {version_}')
+    if n_nodes > max_nodes:
+        raise ValueError(f'invalid art: more than {max_nodes} nodes')
+    ops = data[header.size:header.size + n_nodes]
+    params = array('d')
+    try:
+        params.frombytes(data[header.size + n_nodes:])
+    except ValueError:
+        raise ValueError('invalid art: truncated parameters') from None
+    if sys.byteorder == 'big':
+        params.byteswap()
+
+    ops, params = iter(ops), iter(params)
+
+    def read(depth):
+        if depth > max_depth:
+            raise ValueError(f'invalid art: deeper than {max_depth}')
+        cls = operators[next(ops)]
+        op = cls.__new__(cls)
+        for p in parameters.get(cls, ()):
+            setattr(op, p, _from_float.get(p, float)(next(params)))
+        for c in children[cls]:
+            setattr(op, c, read(depth + 1))
+        return op
+
+    try:
+        return read(1)
+    except (StopIteration, IndexError):
+        raise ValueError('invalid art: truncated or unknown operator') from None
+    except OverflowError as e:
+        raise ValueError(f'invalid art: {e}') from None
+
+
+def from_jsonpickle(s, max_nodes=max_nodes, max_depth=max_depth):
+    """
+    convert the json of an art, as made by jsonpickle.encode, into the art. Unlike jsonpickle.decode,
+    only the known operators are created.
+    References to objects that occur more than once (py/id) are rejected: the arts are trees, so they have none,
+    and a reference to an ancestor would make a cycle.
+    :param s: str or bytes
+    :param max_nodes: larger trees are rejected
+    :param max_depth: deeper trees are rejected
+    :return: the root Operator of the tree
+    """
+    classes = {f'{cls.__module__}.{cls.__name__}': cls for cls in operators}
+    n_nodes = 0
+
+    def read(d, depth):
+        nonlocal n_nodes
+        if not isinstance(d, dict):
+            raise ValueError(f'invalid art: expected an operator, got {d!r}')
+        if 'py/id' in d:
+            raise ValueError('invalid art: references between the nodes (py/id) are not supported')
+        n_nodes += 1
+        if n_nodes > max_nodes:
+            raise ValueError(f'invalid art: more than {max_nodes} nodes')
+        if depth > max_depth:
+            raise ValueError(f'invalid art: deeper than {max_depth}')
+        try:
+            cls = classes[d.get('py/object')]
+        except KeyError:
+            raise ValueError(f'invalid art: unknown operator {d.get("py/object")}') from None
+        state = d.get('py/state', d)
+        op = cls.__new__(cls)
+        for p in parameters.get(cls, ()):
+            value = state[p] if p in state or p not in _defaults else _defaults[p]
+            setattr(op, p, _from_float.get(p, float)(_to_float.get(p, float)(value)))
+        for c in children[cls]:
+            setattr(op, c, read(state[c], depth + 1))
+        return op
+
+    try:
+        return read(json.loads(s), 1)
+    except RecursionError:  # of json.loads
+        raise ValueError('invalid art: nested too deeply') from None
+    except (KeyError, IndexError, TypeError, OverflowError) as e:
+        raise ValueError(f'invalid art: {e!r}') from None
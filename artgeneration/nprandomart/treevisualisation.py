@@ -2,56 +2,51 @@
 functionality to visualise the art object, which is a tree of operators
 """
 
-import ete3
 from itertools import chain
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
+from functools import lru_cache
 import numpy as np
 from math import floor
-from ete3 import Tree,  TreeNode
 import io
+from PIL import Image, ImageDraw, ImageFont
+from .image import quantize, get_image_with_thumbnails
+from .layout import Node, get_tree, get_layout, get_ascii
 
-plt.style.use("dark_background")  # because the webapp background is black
 
+@lru_cache(maxsize=None)
+def get_pyplot():
+    """matplotlib is imported only when it is used for plotting, as it takes long to import"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use("dark_background")  # because the webapp background is black
+    return plt
 
-def get_tree_with_operator_images(art):
+
+def get_tree_with_operator_images(art, thumbnails=None):
     """
-    return an ete3 tree where an image representing the output of an
+    return a tree (of layout.Node) where an image representing the output of an
     operator has been added to each node
+    :param thumbnails: the outputs of the nodes, as returned by get_image_with_thumbnails;
+    rendered at thumbnail size if not given
     """
-
-    root = TreeNode()
-    def repr(op, node):
-        if op.arity == 0:
-            ch = node.add_child(name=str(op))
-            ch.image = op.img
-        else:
-            ch = node.add_child(name=str(op))
-            ch.image = op.img
-            for k, v in vars(op).items():
-                if k in ['e', 'e1', 'e2', 'level']:
-                    repr(v, ch)
-
-        return node
-
-    t = repr(art, root)
-    return t
+    if thumbnails is None:
+        _, thumbnails = get_image_with_thumbnails(art)
+    return get_tree(art, thumbnails)
 
 
 def plot_tree_with_images(tree):
     """
     This function is modified version of Francois Serra's script:
     https://gist.github.com/fransua/da703c3d2ba121903c0de5e976838b71
-    :param tree: ete3 tree
+    :param tree: tree, as made by get_tree_with_operator_images
     :return:
     """
+    plt = get_pyplot()
 
     figsize = 25
     fig = plt.figure(figsize=(figsize, figsize))
-    number_of_branches = tree.get_farthest_node()[1]
-    number_of_leaves = len(list(tree.iter_leaves()))
+    number_of_branches = max(x for x, _ in get_layout(tree)[0].values())  # the depth of the tree
+    number_of_leaves = len(tree.get_leaves())
 
     plt_xmin, plt_ymin = 0.1, 0.1
     plt_width = 0.07 * number_of_branches  # plt_width =  0.55
@@ -75,12 +70,7 @@ def plot_tree_with_images(tree):
         node_axes.set_xticks([])
         node_axes.set_yticks([])
 
-        (r, g, b) = node.image
-        rgbArray = np.zeros((r.shape[0], r.shape[1], 3), 'uint8')
-        rgbArray[..., 0] = r * 256
-        rgbArray[..., 1] = g * 256
-        rgbArray[..., 2] = b * 256
-        node_axes.imshow(rgbArray)
+        node_axes.imshow(quantize(node.image))
 
         # img = np.stack(node.image, axis=2)
         # node_axes.imshow(img)  # to show only r/g/b use: imshow(img[:,:,0],cmap='Reds')
@@ -92,6 +82,7 @@ def plot_tree_with_images(tree):
     return fig
 
 def as_bytesio(fig):
+    plt = get_pyplot()
     output = io.BytesIO()
     plt.savefig(output, bbox_inches='tight',format='png')
     plt.close(fig)
@@ -103,48 +94,12 @@ def plot_tree(tree, axes):
     This function is modified version of Francois Serra's script:
     https://gist.github.com/fransua/da703c3d2ba121903c0de5e976838b71
 
-    Plots a ete3.Tree object using matplotlib.
-    :param tree: ete Tree object
+    Plots the tree using matplotlib.
+    :param tree: layout.Node
     :returns: a dictionary of node objects with their coordinates
     """
-
-    def __draw_edge(c, x):
-        h = node_pos[c]
-        hlinec.append(((x, h), (x + c.dist, h)))
-        return (x + c.dist, h)
-
-    vlinec = []
-    hlinec = []
-    nodex = []
-    nodey = []
-
-
-    coords = {}
-    node_pos = dict((n2, i) for i, n2 in enumerate(tree.get_leaves()[::-1]))
-    node_list = tree.iter_descendants(strategy='postorder')
-    node_list = chain(node_list, [tree])
-
-    # draw tree
-    for n in node_list:
-        x = sum(n2.dist for n2 in n.iter_ancestors()) + n.dist
-        if n.is_leaf():
-            y = node_pos[n]
-        else:
-            y = np.mean([node_pos[n2] for n2 in n.children])
-            node_pos[n] = y
-
-            # draw vertical line
-            vlinec.append(((x, node_pos[n.children[0]]), (x, node_pos[n.children[-1]])))
-
-
-            # draw horizontal lines
-            for child in n.children:
-                coords[child] = __draw_edge(child, x)
-
-        nodex.append(x)
-        nodey.append(y)
-
-
+    from matplotlib.collections import LineCollection
+    coords, hlinec, vlinec = get_layout(tree)
 
     hline_col = LineCollection(hlinec, colors=['white' for l in hlinec],
                                linestyle=['-' for l in hlinec],
@@ -172,6 +127,52 @@ def plot_tree(tree, axes):
     return coords
 
 
+def draw_tree_with_images(tree, thumbnail_size=100, font_size=9):
+    """
+    draw the tree, with the image of each node, straight into a single image; the same picture as
+    plot_tree_with_images, but without a matplotlib figure (and axes for each node), so much faster
+    :param tree: tree, as made by get_tree_with_operator_images
+    :param thumbnail_size: width and height of the image of a node, in pixels
+    :return: PIL image
+    """
+    coords, hlines, vlines = get_layout(tree)
+
+    # the distances between the nodes relative to the size of their images, as in (the saved) plot_tree_with_images
+    dx = thumbnail_size * 1.2
+    dy = thumbnail_size * 0.76
+    margin = thumbnail_size  # half a node image, and room for the name above it
+    points = list(chain(coords.values(), *hlines, *vlines))
+    xmin = min(x for x, _ in points)
+    ymin = min(y for _, y in points)
+    ymax = max(y for _, y in points)
+    xmax = max(x for x, _ in points)
+
+    def to_pixels(x, y):
+        return round(margin + (x - xmin) * dx), round(margin + (ymax - y) * dy)
+
+    canvas = Image.new('RGB', to_pixels(xmax + margin / dx, ymin - margin / dy), 'black')
+    draw = ImageDraw.Draw(canvas)
+    for line in chain(hlines, vlines):
+        draw.line([to_pixels(*point) for point in line], fill='white', width=1)
+
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:  # Pillow < 10.1, which has a fixed size bitmap font only
+        font = ImageFont.load_default()
+    half = thumbnail_size // 2
+    for node, (x, y) in coords.items():
+        px, py = to_pixels(x, y)
+        image = Image.fromarray(quantize(node.image)).resize((thumbnail_size, thumbnail_size), Image.BILINEAR)
+        canvas.paste(image, (px - half, py - half))
+        draw.rectangle((px - half, py - half, px - half + thumbnail_size, py - half + thumbnail_size), outline='white')
+        name = node.name.replace(')(', ')\n(')
+        left, top, right, bottom = draw.multiline_textbbox((0, 0), name, font=font, align='center')
+        draw.multiline_text((px - (right - left) / 2 - left, py - half - bottom), name,
+                            fill='white', font=font, align='center')
+
+    return canvas
+
+
 def round_sig(x, sig=2):
     return round(x, sig - int(floor(np.log10(abs(x)))) - 1)
 
@@ -188,28 +189,14 @@ def tree_as_ascii(art):
     :return: str
     """
 
-    t = ete3.Tree()
-    img = t.add_child(name="R,G,B = F(X,Y) :")
-
-    def repr(op, t):
-        if op.arity == 0:
-            t.add_child(name='--'+str(op))
-        else:
-            ch = t.add_child(name='--'+ str(op))
-            for k, v in vars(op).items():
-                if k in ['e','e1','e2','level']:
-                    repr(v, ch)
-
-    repr(art, img)
-
-    return t.get_ascii(show_internal=True,compact=False)
+    t = Node(children=[Node("R,G,B = F(X,Y) :", [get_tree(art, name=lambda op: '--' + str(op))])])
+    return get_ascii(t)
 
 if __name__ == '__main__':
-    from nprandomart import get_art, get_image
+    from nprandomart import get_art
 
     arity = 60
     art = get_art(min_arity=arity, max_arity=arity + 1)
-    get_image(art)
     tree = get_tree_with_operator_images(art)
     fig = plot_tree_with_images(tree)
-    plt.savefig('fig.png', bbox_inches='tight')
+    get_pyplot().savefig('fig.png', bbox_inches='tight')
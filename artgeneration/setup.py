@@ -8,5 +8,5 @@ setup(name='nprandomart',
       url='',
       packages=['nprandomart'],
       requires=['numpy', 'numba', 'Pillow',
-                'ete3', 'matplotlib']
+                'matplotlib']
       )
@@ -18,19 +18,286 @@ def test_get_art():
     art = get_art(10,20)
     assert isinstance(art, Operator)
 
+def test_seed():
+    import random, jsonpickle
+    art1 = get_art(10, 40, seed=3)
+    art2 = get_art(10, 40, seed=3)
+    assert jsonpickle.encode(art1) == jsonpickle.encode(art2)
+    assert get_image(art1, 30).tobytes() == get_image(art2, 30).tobytes()
+    assert jsonpickle.encode(get_art(10, 40, seed=4)) != jsonpickle.encode(art1)
+    assert jsonpickle.encode(get_art(10, 40, seed=random.Random(3))) == jsonpickle.encode(art1)
+
+def test_lazy_import():
+    import subprocess, sys
+    code = ("import sys, nprandomart\n"
+            "nprandomart.get_art(5, 10)\n"
+            "assert not {'numba', 'matplotlib', 'PIL'} & set(sys.modules)\n"
+            "nprandomart.warmup()\n"
+            "assert 'numba' in sys.modules\n")
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=this_dir.parent)
+
+def test_fractal_in_thread():
+    import subprocess, sys
+    # numba's threads are started by a thread other than the main thread; the process must still exit
+    code = ("import threading\n"
+            "from nprandomart.randomart import Mandle\n"
+            "Mandle.setup()\n"
+            "thread = threading.Thread(target=Mandle().get_fractal, args=(20,))\n"
+            "thread.start()\n"
+            "thread.join()\n")
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=this_dir.parent, timeout=120)
+
+
+# compiler tests
+import numpy as np
+from nprandomart.compiler import compile_art
+
+def test_compiled_equals_recursive():
+    for k in [0, 5, 40, 100]:
+        art = get_art(k, k + 1)
+        u, v = np.meshgrid(np.linspace(0, 1, 50), np.linspace(0, 1, 50))
+        for c1, c2 in zip(art.eval(u, v), compile_art(art).run(u, v)):
+            assert np.array_equal(c1, c2, equal_nan=True)
+
+def test_separable():
+    from nprandomart.randomart import VariableX, VariableY, Sin, Tent, Product
+    from nprandomart.compiler import FULL
+    art = Product(Sin(Tent(VariableX())), Sin(VariableY()))
+    program = compile_art(art)
+    assert [kind for _, kind in program.registers].count(FULL) == 1  # only the product
+    assert len(set(program.outputs)) == 1  # the channels are the same, so computed once
+    u, v = np.meshgrid(np.linspace(0, 1, 30), np.linspace(0, 1, 20))
+    for c1, c2 in zip(art.eval(u, v), program.run(u, v)):
+        assert c2.shape == (20, 30)
+        assert np.array_equal(c1, c2)
+
+def test_tiled():
+    art = get_art(20, 80, seed=3)
+    for dtype in [np.float64, np.float32]:
+        img = np.asarray(get_image(art, 150, dtype=dtype))
+        tiled = np.asarray(get_image(art, 150, tile_size=16, dtype=dtype))
+        assert np.array_equal(np.asarray(get_image(art, 150, tile_size=64, workers=3, dtype=dtype)), tiled)
+        assert np.array_equal(tiled, img)  # the weights of Mix are summed the same way
+
+def test_subtree_memo():
+    from nprandomart.compiler import subtrees
+    from nprandomart.randomart import Product, Sin, Tent, VariableX, VariableY
+    shared = Sin(Product(Tent(VariableX()), VariableY()))
+    art = Product(shared, VariableX())
+    img = np.asarray(get_image(art, 40, memo=False))
+    subtrees.clear()
+    assert np.array_equal(np.asarray(get_image(art, 40, memo=True)), img)
+    hits, nbytes = subtrees.info()['hits'], subtrees.info()['bytes']
+    assert nbytes > 0
+    assert np.array_equal(np.asarray(get_image(art, 40, memo=True)), img)
+    assert subtrees.info()['hits'] > hits
+    other = Product(shared, VariableY())  # shares a stored subtree
+    hits = subtrees.info()['hits']
+    assert np.array_equal(np.asarray(get_image(other, 40, memo=True)), np.asarray(get_image(other, 40, memo=False)))
+    assert subtrees.info()['hits'] > hits
+    hits = subtrees.info()['hits']
+    get_image(art, 41, memo=True)  # another size
+    get_image(art, 40)  # off by default
+    assert subtrees.info()['hits'] == hits
+    with pytest.raises(ValueError):
+        compile_art(art, nodes=True, memo=subtrees, size=40)
+
+def test_quantize():
+    import pytest
+    from nprandomart.image import quantize
+    c = np.array([[-0.1, 0., 0.5, 1., 1.5, np.nan]])
+    assert quantize((c, c, c))[0, :, 0].tolist() == [231, 0, 128, 0, 128, 0]
+    assert quantize((c, c, c), mode='clip')[0, :, 1].tolist() == [0, 0, 128, 255, 255, 0]
+    large = [12345678.37, -12345678.37, 1e15 + 0.3, -3e9, 1e30, -np.inf, np.inf]
+    wrapped = [int(v * 256) % 256 if np.isfinite(v) else 0 for v in large]  # the true wrap
+    assert wrapped[0] == 94
+    assert quantize((np.array([large]),) * 3)[0, :, 2].tolist() == wrapped
+    from nprandomart.jit import to_uint8
+    assert [to_uint8(v) for v in large] == wrapped
+    from nprandomart.precision import quantize as precision_quantize
+    assert precision_quantize(np.array([large])).tolist() == [wrapped]
+    art = get_art(20, 21, seed=1)
+    img = np.asarray(get_image(art, 40, quantization='clip'))
+    assert np.array_equal(np.asarray(get_image(art, 40, tile_size=16, quantization='clip')), img)
+    with pytest.raises(ValueError):
+        quantize((c, c, c), mode='round')
+
+def test_float32():
+    from nprandomart.precision import compare_art
+    art = get_art(40, 41, seed=5)
+    u, v = np.meshgrid(np.linspace(0, 1, 50, dtype=np.float32), np.linspace(0, 1, 50, dtype=np.float32))
+    for c1, c2 in zip(art.eval(u, v), compile_art(art).run(u, v)):
+        assert c1.dtype == c2.dtype == np.float32
+        assert np.array_equal(c1, c2, equal_nan=True)
+    assert np.array_equal(np.asarray(get_image(art, 50, dtype=np.float32)),
+                          np.asarray(get_image(art, 50, dtype=np.float32, tile_size=50)))
+    result = compare_art(art, size=30)
+    assert 0 <= result['difference'] <= 1
+    assert result['nodes'][-1][0] == type(art).__name__
+
+def test_jit(monkeypatch):
+    import gc
+    import weakref
+    from copy import deepcopy
+    from nprandomart import jit
+    from nprandomart.cache import LRUCache
+    from nprandomart.randomart import Product, VariableX
+    art = generate(k=5)
+    assert np.array_equal(jit.render(art, 30), np.asarray(get_image(art, 30)))
+    n_kernels = len(jit.kernels)
+    art2 = deepcopy(art)
+    for op in [art2, *vars(art2).values()]:
+        if hasattr(op, 'c1'):
+            op.c1 = 1 - op.c1  # parameter only difference
+    assert np.array_equal(jit.render(art2, 30), np.asarray(get_image(art2, 30)))
+    assert len(jit.kernels) == n_kernels
+    monkeypatch.setattr(jit, 'kernels', LRUCache(max_bytes=1, sizeof=lambda kernel: 1))
+    jit.render(art, 30)
+    kernel = weakref.ref(next(iter(jit.kernels.data.values()))[0])
+    jit.render(art, 31)
+    assert len(kernel().signatures) == 1  # compiled once, when it was made
+    jit.render(Product(art, VariableX()), 30)  # another structure evicts the kernel of art
+    assert len(jit.kernels) == 1
+    gc.collect()
+    assert kernel() is None  # and nothing else keeps it (or its machine code) alive
+
+def test_mandlebrot():
+    from nprandomart.mandle import get_mandlebrot
+    m = get_mandlebrot(-2., 1., -1.5, 1.5, size=40, maxiter=200)
+    assert m.shape == (40, 40) and m.dtype == np.float64
+    assert m[20, 20] == 0  # in the set
+    smooth = get_mandlebrot(-2., 1., -1.5, 1.5, size=40, maxiter=200, smooth=True)
+    assert smooth[20, 20] == 0 and np.isfinite(smooth).all()
+    assert np.corrcoef(smooth[m > 0], m[m > 0])[0, 1] > 0.9
+    m32 = get_mandlebrot(-2., 1., -1.5, 1.5, size=40, maxiter=200, dtype=np.float32)
+    assert m32.dtype == np.float32
+
+def test_fractal_cache():
+    import jsonpickle
+    from nprandomart.mandle import Mandle, fractals
+    Mandle.setup()
+    m1 = Mandle()
+    Mandle.setup()
+    m2 = Mandle()
+    assert m1.get_fractal(20) is m1.get_fractal(20)
+    hits = fractals.info()['hits']
+    m1_decoded = jsonpickle.decode(jsonpickle.encode(m1))
+    m1_decoded.normalize_to_one = m1.normalize_to_one
+    assert m1_decoded.get_fractal(20) is m1.get_fractal(20)
+    assert fractals.info()['hits'] > hits
+    if (m1.xmin, m1.ymin) != (m2.xmin, m2.ymin):
+        assert not np.array_equal(m1.get_fractal(20), m2.get_fractal(20))
+
+
+# serialization tests
+import pytest
+from nprandomart import serialization
+
+def test_serialization():
+    import json, jsonpickle, random, struct
+    for seed in range(10):
+        art = get_art(10, 80, seed=seed)
+        state = json.loads(jsonpickle.encode(art))
+        decoded = serialization.decode(serialization.encode(art))
+        assert json.loads(jsonpickle.encode(decoded)) == state
+        converted = serialization.from_jsonpickle(jsonpickle.encode(art))
+        assert json.loads(jsonpickle.encode(converted)) == state
+    with pytest.raises(ValueError):
+        serialization.decode(serialization.encode(art)[:-4])
+    with pytest.raises(ValueError):
+        serialization.from_jsonpickle('{"py/object": "os.system", "py/state": {}}')
+    with pytest.raises(ValueError):  # a cycle
+        serialization.from_jsonpickle('{"py/object": "nprandomart.randomart.Tent", "py/state": {"e": {"py/id": 1}}}')
+    deep = '{"py/object": "nprandomart.randomart.VariableX"}'
+    for _ in range(300):
+        deep = '{"py/object": "nprandomart.randomart.Tent", "py/state": {"e": %s}}' % deep
+    with pytest.raises(ValueError):
+        serialization.from_jsonpickle(deep)
+    with pytest.raises(ValueError):
+        serialization.decode(serialization.encode(serialization.from_jsonpickle(deep, max_depth=400)))
+    with pytest.raises(ValueError):
+        serialization.from_jsonpickle(jsonpickle.encode(art), max_nodes=10)
+    # parameters out of range, that would fail (or hang) the render
+    from nprandomart.randomart import Mandle, Mix, VariableX, VariableY
+    Mandle.setup(random.Random(0))
+    for maxiter in ('Infinity', 'NaN', '1e400', '10' * 200, '50000', '0'):
+        state = json.loads(jsonpickle.encode(Mandle()))
+        state['py/state']['maxiter'] = 0
+        with pytest.raises(ValueError):
+            serialization.from_jsonpickle(json.dumps(state).replace('"maxiter": 0', f'"maxiter": {maxiter}'))
+    mandle = Mandle()
+    mandle.maxiter = float('inf')
+    with pytest.raises(ValueError):
+        serialization.decode(serialization.encode(mandle))
+    mix = Mix(VariableX(), VariableX(), VariableY())
+    for color in ('', 'rg', 'x', 0):
+        state = json.loads(jsonpickle.encode(mix))
+        state['py/state']['weighing_color'] = color
+        with pytest.raises(ValueError):
+            serialization.from_jsonpickle(json.dumps(state))
+    encoded = serialization.encode(mix)
+    with pytest.raises(ValueError):  # the weighing color index 3, the only parameter
+        serialization.decode(encoded[:-8] + struct.pack('<d', 3))
+    mix.weighing_color = 'rg'
+    with pytest.raises(ValueError):
+        serialization.encode(mix)
+
+def test_structural_hash():
+    import jsonpickle
+    from nprandomart import structural_hash
+    from nprandomart.randomart import Product, VariableX, VariableY
+    art = get_art(10, 80, seed=7)
+    h = structural_hash(art)
+    assert len(h) == 32
+    assert structural_hash(get_art(10, 80, seed=7)) == h
+    assert structural_hash(serialization.from_jsonpickle(jsonpickle.encode(art))) == h
+    assert structural_hash(get_art(10, 80, seed=8)) != h
+    assert structural_hash(Product(VariableX(), VariableY())) != structural_hash(Product(VariableY(), VariableX()))
+    cyclic = Product(VariableX(), VariableY())
+    cyclic.e2 = cyclic
+    with pytest.raises(ValueError):
+        structural_hash(cyclic)
+
 
 # tree-visualisation tests
 from nprandomart.treevisualisation import plot_tree_with_images, tree_as_ascii, get_tree_with_operator_images
+from nprandomart.image import get_image_with_thumbnails
+from nprandomart.compiler import children
 
 def test_ascii():
     art = generate(k=5)
     s = tree_as_ascii(art)
     assert isinstance(s,str)
+    from nprandomart.randomart import Product, VariableX, VariableY, Tent
+    assert tree_as_ascii(Product(VariableX(), Tent(VariableY()))) == '\n'.join([
+        '',
+        '                                   /---ReturnX(X,Y)',
+        '-- /R,G,B = F(X,Y) :--Product(E1,E2)',
+        '                                   \\--TentFunction(E1)---ReturnY(X,Y)'])  # as drawn by ete3
 
 def test_plot():
     arity = 12
-    art = get_art(min_arity=arity, max_arity=arity + 1)
-    get_image(art) #so that thumbnails are added
-    tree = get_tree_with_operator_images(art)
+    art = get_art(min_arity=arity, max_arity=arity + 1, seed=6)  # a Mix
+    img, thumbnails = get_image_with_thumbnails(art, 100, thumbnail_size=50)
+    assert np.array_equal(np.asarray(img), np.asarray(get_image(art, 100)))
+    u, v = np.meshgrid(np.linspace(0, 1, 100), np.linspace(0, 1, 100))
+    # the nodes that are plotted; those of the w expression of a Mix are captured for the weighing color only
+    for op in [art] + [getattr(art, c) for c in children.get(type(art), ()) if c != 'w']:
+        for c1, c2 in zip(op.eval(u, v), thumbnails[id(op)]):
+            assert np.array_equal(c1[::2, ::2], c2, equal_nan=True)
+    assert not any('img' in vars(op) for op in [art, *vars(art).values()] if isinstance(op, Operator))
+    tree = get_tree_with_operator_images(art, thumbnails)
     fig = plot_tree_with_images(tree)
-    # plt.savefig('fig.png', bbox_inches='tight')
\ No newline at end of file
+    # plt.savefig('fig.png', bbox_inches='tight')
+
+def test_draw_tree():
+    from nprandomart.treevisualisation import draw_tree_with_images
+    from nprandomart.layout import get_layout
+    art = get_art(10, 11, seed=2)
+    _, thumbnails = get_image_with_thumbnails(art)
+    tree = get_tree_with_operator_images(art, thumbnails)
+    img = draw_tree_with_images(tree, thumbnail_size=40)
+    assert img.mode == 'RGB'
+    coords, hlines, vlines = get_layout(tree)
+    assert len(coords) == len(list(tree.traverse())) and len(vlines) == len(coords) - len(tree.get_leaves())
+    assert img.width > 40 * max(x for x, _ in coords.values()) and img.height > 30 * len(tree.get_leaves())
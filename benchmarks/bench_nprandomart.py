@@ -0,0 +1,149 @@
+"""
+benchmarks of the art generation: generation, rendering, fractals, serialization and tree plotting.
+The arts are generated with fixed seeds, named '<operator mix>-<arity>'
+"""
+
+import random
+from functools import lru_cache
+import jsonpickle
+import numpy as np
+from nprandomart import get_art, get_image, serialization
+from nprandomart.image import get_image_with_thumbnails
+from nprandomart.randomart import generate, generation_lock, operators, VariableX, VariableY, Constant, \
+    Average, Product, Mod, Level, Sin, Tent, Well
+from nprandomart.mandle import Mandle, get_locations, fractals, get_mandlebrot
+from nprandomart.compiler import subtrees
+
+operator_mixes = {'default': operators,
+                  'fractal': operators + [Mandle],
+                  'arithmetic': [VariableX, VariableY, Constant, Average, Product, Mod, Level],
+                  'trigonometric': [VariableX, VariableY, Constant, Average, Sin, Tent, Well]}
+
+trees = ['default-20', 'default-50', 'default-150', 'fractal-50', 'arithmetic-50', 'trigonometric-50']
+
+
+@lru_cache()
+def get_tree(name, seed=0):
+    mix, arity = name.split('-')
+    rng = random.Random(seed)
+    with generation_lock:
+        Mandle.setup(rng)
+        return generate(int(arity), operators=operator_mixes[mix], rng=rng)
+
+
+class Generation:
+    params = [20, 50, 150]
+
+    def time_get_art(self, arity):
+        get_art(arity, arity + 1, seed=0)
+
+
+class Render:
+    params = [[200, 900, 1920], trees]
+
+    def setup(self, size, tree):
+        get_tree(tree)
+        fractals.clear()
+        subtrees.clear()
+
+    def time_get_image(self, size, tree):
+        get_image(get_tree(tree), size=size)
+
+
+class RenderEngines:
+    params = [['recursive', 'compiled', 'float32', 'tiled', 'jit'], ['default-50', 'fractal-50']]
+    options = {'recursive': {'compiled': False}, 'compiled': {}, 'float32': {'dtype': np.float32},
+               'tiled': {'tile_size': 64}, 'jit': {'jit': True}}
+
+    def setup(self, engine, tree):
+        if engine == 'jit':
+            get_image(get_tree(tree), size=16, jit=True)  # compile the kernel
+        fractals.clear()
+        subtrees.clear()
+
+    def time_get_image(self, engine, tree):
+        get_image(get_tree(tree), size=900, **self.options[engine])
+
+
+class RenderWorkers:
+    """
+    scaling of the band rendering with the number of threads, up to 4K. All run in bands of 64 rows, so that
+    workers=1 is the baseline of the same work (without tile_size, workers=1 renders the whole image at once).
+    The threads only speed up the render on as many cores, see the cpu_count of the results.
+    """
+    params = [[1, 2, 4, 8], [1920, 3840]]
+
+    def setup(self, workers, size):
+        get_tree('default-50')
+        fractals.clear()
+
+    def time_get_image(self, workers, size):
+        get_image(get_tree('default-50'), size=size, tile_size=64, workers=workers)
+
+
+class SubtreeMemo:
+    """rendering without the memo, with an empty one, and once more with the subtrees of the art in it"""
+    params = [['off', 'cold', 'warm'], ['default-50', 'default-150']]
+
+    def setup(self, memo, tree):
+        subtrees.clear()
+        if memo == 'warm':
+            get_image(get_tree(tree), size=900, memo=True)
+
+    def time_get_image(self, memo, tree):
+        get_image(get_tree(tree), size=900, memo=memo != 'off')
+
+
+class Mandlebrot:
+    params = [list(range(0, len(get_locations()), len(get_locations()) // 5)), [200, 900]]
+
+    def setup(self, location, size):
+        get_mandlebrot(0, 1, 0, 1, 2, 10)  # compile the kernel
+
+    def time_get_mandlebrot(self, location, size):
+        xmin, xmax, ymin, ymax, maxiter = get_locations()[location]
+        get_mandlebrot(xmin, xmax, ymin, ymax, size, int(maxiter))
+
+
+class Serialization:
+    params = trees
+
+    def setup(self, tree):
+        self.encoded = jsonpickle.encode(get_tree(tree))
+        self.binary = serialization.encode(get_tree(tree))
+
+    def time_jsonpickle_encode(self, tree):
+        jsonpickle.encode(get_tree(tree))
+
+    def time_jsonpickle_decode(self, tree):
+        jsonpickle.decode(self.encoded)
+
+    def time_binary_encode(self, tree):
+        serialization.encode(get_tree(tree))
+
+    def time_binary_decode(self, tree):
+        serialization.decode(self.binary)
+
+    def track_jsonpickle_bytes(self, tree):
+        return len(self.encoded.encode())
+
+    def track_binary_bytes(self, tree):
+        return len(self.binary)
+
+
+class TreePlot:
+    params = ['default-20', 'default-50', 'fractal-50']
+
+    def setup(self, tree):
+        _, self.thumbnails = get_image_with_thumbnails(get_tree(tree), size=200)
+
+    def time_get_image_with_thumbnails(self, tree):
+        get_image_with_thumbnails(get_tree(tree), size=200)
+
+    def time_plot_tree_with_images(self, tree):
+        from nprandomart.treevisualisation import get_tree_with_operator_images, plot_tree_with_images, as_bytesio
+        as_bytesio(plot_tree_with_images(get_tree_with_operator_images(get_tree(tree), self.thumbnails)))
+
+    def time_draw_tree_with_images(self, tree):
+        from nprandomart.treevisualisation import get_tree_with_operator_images, draw_tree_with_images
+        draw_tree_with_images(get_tree_with_operator_images(get_tree(tree), self.thumbnails))
@@ -0,0 +1,93 @@
+"""
+benchmarks of the latency of the web app endpoints, through the flask test client.
+'cold' requests render the image (and compute its fractals), 'warm' requests are served from the render cache.
+The landing page is measured with the image that the browser requests next, with and without the pool of arts.
+The encoding of the images is measured per format; 'png-rgba' is how the images were encoded before (as RGBA,
+at Pillow's default compression level).
+"""
+
+import atexit
+import re
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from nprandomart.mandle import fractals
+from nprandomart import get_image
+from rawebapp import create_app, encoding
+from bench_nprandomart import get_tree
+
+art_id = 'benchmark'
+
+
+@lru_cache()
+def get_client(pool_size=0):
+    # the caches are in a temporary directory, not in the app's instance folder, as the cold requests clear them
+    instance_path = tempfile.mkdtemp(prefix='bench_webapp_')
+    atexit.register(shutil.rmtree, instance_path, ignore_errors=True)
+    app = create_app({'TESTING': True, 'ART_POOL_SIZE': pool_size}, instance_path=instance_path)
+    app.arts.store_art(art_id, get_tree('fractal-50'))
+    return app, app.test_client()
+
+
+class Endpoints:
+    params = [['preview_image_file', 'image_file', 'large_image_file', 'tree_image_file', 'tree_file'],
+              ['cold', 'warm']]
+
+    def setup(self, endpoint, cache):
+        app, client = get_client()
+        if cache == 'cold':
+            app.renders.memory.clear()
+            app.renders.disk.clear()
+            fractals.clear()
+            if app.subtrees is not None:
+                app.subtrees.clear()
+        else:
+            client.get(f'/{endpoint}/{art_id}')
+
+    def time_get(self, endpoint, cache):
+        client = get_client()[1]
+        response = client.get(f'/{endpoint}/{art_id}')
+        if response.status_code == 202:  # rendered by a background job
+            status_url = response.json['status_url']
+            while client.get(status_url + '?wait=2').json['status'] in ('queued', 'running'):
+                pass  # each request waits at most RENDER_JOB_MAX_WAIT for the job
+            response = client.get(f'/{endpoint}/{art_id}')
+        assert response.status_code == 200
+
+
+class Pages:
+    params = [0, 4]  # size of the art pool
+
+    def setup(self, pool_size):
+        app, client = get_client(pool_size)
+        while sum(app.pool.info()['ready'].values()) < pool_size * len(app.pool.items):
+            time.sleep(0.1)  # wait for the pool to be filled
+
+    def time_index(self, pool_size):
+        client = get_client(pool_size)[1]
+        art_id = re.search(rb'/image_file/(\w+)', client.get('/').data).group(1).decode()
+        client.get(f'/image_file/{art_id}')
+
+
+@lru_cache()
+def get_rendered_image(size):
+    return get_image(get_tree('fractal-50'), size=size)
+
+
+class Encoding:
+    params = [[900, 1920], ['png-rgba', 'png', 'webp', 'jpeg']]
+
+    def setup(self, size, format):
+        get_rendered_image(size)
+
+    def encode(self, size, format):
+        if format == 'png-rgba':
+            return encoding.encode(get_rendered_image(size).convert('RGBA'), 'png', png_compress_level=6)
+        return encoding.encode(get_rendered_image(size), format)
+
+    def time_encode(self, size, format):
+        self.encode(size, format)
+
+    def track_bytes(self, size, format):
+        return len(self.encode(size, format))
@@ -0,0 +1,129 @@
+"""
+runs the benchmarks (asv style) and writes the results as json, for comparison across commits.
+
+A benchmark module (bench_*.py in this directory) contains classes with:
+- params: a list of values (or a list of lists, one per parameter), optional
+- setup(self, *params): called before each repeat, optional
+- time_*(self, *params): the timed functions
+- track_*(self, *params): functions that return a value to record instead, e.g. a number of bytes
+
+usage:
+    python run_benchmarks.py [--filter get_image] [--repeat 3] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+this_dir = Path(__file__).parent
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=this_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def iter_benchmarks(name_filter=None):
+    """yield (name, class, method name) for all benchmarks"""
+    sys.path.insert(0, str(this_dir))
+    for path in sorted(this_dir.glob('bench_*.py')):
+        module = importlib.import_module(path.stem)
+        for class_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            for method in sorted(m for m in vars(cls) if m.startswith(('time_', 'track_'))):
+                name = f'{path.stem}.{class_name}.{method}'
+                if name_filter is None or name_filter in name:
+                    yield name, cls, method
+
+
+def get_param_combinations(cls):
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if params and all(isinstance(p, list) for p in params):
+        return list(itertools.product(*params))
+    return [(p,) for p in params]
+
+
+def run(name_filter=None, repeat=3):
+    results = {}
+    for name, cls, method in iter_benchmarks(name_filter):
+        results[name] = []
+        for params in get_param_combinations(cls):
+            benchmark = cls()
+            if method.startswith('track_'):
+                if hasattr(benchmark, 'setup'):
+                    benchmark.setup(*params)
+                result = {'params': list(params), 'value': getattr(benchmark, method)(*params)}
+                results[name].append(result)
+                print(f'{name}{list(params)}: {result["value"]}', file=sys.stderr)
+                continue
+            times = []
+            for _ in range(repeat):
+                if hasattr(benchmark, 'setup'):
+                    benchmark.setup(*params)
+                start = time.perf_counter()
+                getattr(benchmark, method)(*params)
+                times.append(time.perf_counter() - start)
+            result = {'params': list(params),
+                      'min': min(times),
+                      'median': statistics.median(times),
+                      'times': times}
+            results[name].append(result)
+            print(f'{name}{list(params)}: {result["min"]:.4f}s (median {result["median"]:.4f}s)',
+                  file=sys.stderr)
+    return results
+
+
+def compare(results, old_results):
+    """print the ratio of the new and the old minimum times (or tracked values)"""
+    for name, entries in results.items():
+        old_entries = {json.dumps(e['params']): e for e in old_results.get(name, [])}
+        for entry in entries:
+            old = old_entries.get(json.dumps(entry['params']))
+            if old is not None and 'value' in entry:
+                print(f'{name}{entry["params"]}: {old["value"]} -> {entry["value"]}')
+            elif old is not None:
+                print(f'{name}{entry["params"]}: {old["min"]:.4f}s -> {entry["min"]:.4f}s '
+                      f'({entry["min"] / old["min"]:.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results (json) of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = run(args.filter, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump({'commit': get_commit(),
+                   'timestamp': datetime.now(timezone.utc).isoformat(),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'processor': platform.processor(),
+                   'cpu_count': os.cpu_count(),
+                   'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
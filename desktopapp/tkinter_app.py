@@ -4,6 +4,7 @@ with added image save/load, and expression-tree-to-json buttons
 """
 
 from nprandomart import generate
+from nprandomart.image import quantize
 from nprandomart.randomart import SIZE_2D, SIZE_1D
 from tkinter import *
 from tkinter import filedialog
@@ -57,11 +58,7 @@ class Art():
         print('evaluating expressions')
         (r, g, b) = self.art.eval(u, v)
         print('evaluation done')
-        rgbArray = np.zeros((SIZE_1D, SIZE_1D, 3), 'uint8')
-        rgbArray[..., 0] = r * 256
-        rgbArray[..., 1] = g * 256
-        rgbArray[..., 2] = b * 256
-        self.img = Image.fromarray(rgbArray)
+        self.img = Image.fromarray(quantize((r, g, b)))
         self.img_tk = ImageTk.PhotoImage(self.img)
         self.canvas.create_image(1, 1, image=self.img_tk, anchor=NW)
 
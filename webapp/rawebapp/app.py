@@ -1,19 +1,48 @@
-import os,io
-from flask import Flask, url_for, render_template, Response, Markup, json, jsonify,request
-from werkzeug.wsgi import FileWrapper
+import os
+from flask import Flask, url_for, render_template, Response, Markup, json, jsonify,request, abort
 import uuid
-from .utitlities import LimitedSizeDict, ArtDiskCache
+from .utitlities import ArtDiskCache, RenderCache
+from .jobs import RenderQueue, QueueFull
+from .pool import ArtPool
+from . import encoding
+import nprandomart
 from nprandomart import get_image, get_art
+from nprandomart.randomart import thumbnail_size
+from nprandomart.image import get_image_with_thumbnails
+from nprandomart.cache import LRUCache
+from nprandomart import serialization
 import jsonpickle
-from json.decoder import JSONDecodeError
 from pathlib import Path
 
-def create_app(test_config=None):
+def create_app(test_config=None, instance_path=None):
+    """
+    :param test_config: config mapping used instead of the instance config (instance/config.py)
+    :param instance_path: absolute path of the instance folder, which holds the config and the caches of the arts
+    and the renders; by default the instance folder next to the package. Tests and benchmarks pass a temporary
+    directory, so that they do not use (or clear) the caches of a deployment.
+    """
 
     # create and configure the app
-    app = Flask(__name__, instance_relative_config=True)
+    app = Flask(__name__, instance_relative_config=True, instance_path=instance_path)
     app.config.from_mapping(
         SECRET_KEY='dev',
+        ART_CACHE_MEMORY_LIMIT=256,  # number of decoded arts kept in memory
+        RENDER_CACHE_MEMORY_LIMIT=64e6,  # bytes of rendered images kept in memory
+        RENDER_CACHE_DISK_LIMIT=512e6,  # bytes of rendered images kept on disk
+        RENDER_WORKERS=2,  # threads that render the large images in the background
+        RENDER_QUEUE_LIMIT=16,  # queued and running render jobs, above which requests get a 429
+        RENDER_JOB_MAX_WAIT=2,  # seconds a request for the status of a job may wait for the job to finish; short, as
+                                # the waiting request holds a worker (the page polls without waiting)
+        ART_POOL_TIERS={'landing': (30, 80), 'higher': (30, 80)},  # (min_arity, max_arity) of the pre-generated arts
+        ART_POOL_SIZE=4,  # pre-generated (and rendered) arts kept ready per tier, 0 to disable
+        ART_POOL_WORKERS=1,  # threads that pre-generate the arts
+        IMAGE_PNG_COMPRESS_LEVEL=3,  # zlib level (1-9); 3 is about as small as Pillow's default (6), and faster
+        IMAGE_QUALITY=90,  # of webp and jpeg images
+        IMAGE_PREVIEW_FORMATS=('png', 'webp', 'jpeg'),  # formats of the preview and page view images, chosen by
+                                                        # the format query parameter or the Accept header
+        SUBTREE_MEMO_LIMIT=0,  # bytes of the outputs of subtrees kept to reuse them when arts are rendered again at
+                               # the same size (e.g. after their render was evicted), 0 to disable
+        WARMUP=True,  # compile (or load) the numba kernels when the app is created, rather than on the first request
     )
 
     if test_config is None:
@@ -33,7 +62,25 @@ def create_app(test_config=None):
     # (only the key 'art_id' is passed in the url to the endpoints)
     print(app.instance_path)
     app.arts = ArtDiskCache(directory=Path(app.instance_path) / 'cache',
-                            size_limit=8e6)  # LimitedSizeDict(size_limit=200)
+                            size_limit=8e6,
+                            memory_limit=app.config['ART_CACHE_MEMORY_LIMIT'])
+
+    # the rendered images, so that reloads and downloads do not render again
+    app.renders = RenderCache(directory=Path(app.instance_path) / 'renders',
+                              memory_limit=app.config['RENDER_CACHE_MEMORY_LIMIT'],
+                              disk_limit=app.config['RENDER_CACHE_DISK_LIMIT'])
+
+    # numba's threads must be started in this (the main) thread, before the render threads use them
+    if app.config['WARMUP']:
+        nprandomart.warmup()  # imports numba, which is left out of importing the app
+
+    # the outputs of subtrees, loaded instead of evaluated when a render needs them again
+    app.subtrees = (LRUCache(max_bytes=app.config['SUBTREE_MEMO_LIMIT'])
+                    if app.config['SUBTREE_MEMO_LIMIT'] > 0 else None)
+
+    # the large images are rendered in the background, so that they do not block the request handlers
+    app.jobs = RenderQueue(workers=app.config['RENDER_WORKERS'],
+                           max_pending=app.config['RENDER_QUEUE_LIMIT'])
 
     def get_art_id(min_arity=20, max_arity=150):
         """
@@ -41,61 +88,179 @@ def create_app(test_config=None):
         :param min_arity: minimum complexity of the art
         :param max_arity: maximum complexity of the art
         """
-        art_id = uuid.uuid4().hex
-        print(art_id)
-
         # make expression tree
-        art = get_art(min_arity , max_arity)
+        art = get_art(min_arity , max_arity, seed=uuid.uuid4().hex)
 
-        # store so it can be passed to other app functions by id
-        app.arts.store_art(art_id,art)
+        # store so it can be passed to other app functions by id; the id is the structural hash of the art,
+        # so that identical arts share their stored tree and rendered images
+        art_id = app.arts.add_art(art)
+        app.logger.debug('new art %s', art_id)
         return art_id
 
     def render_page(art_id):
         return render_template('image.html',
+                               preview_image_endpoint = url_for('preview_image_file',art_id=art_id),
                                image_endpoint = url_for('image_file',art_id=art_id),
                                large_image_endpoint = url_for('large_image_file',art_id=art_id),
+                               render_large_image_endpoint = url_for('render_job',art_id=art_id,size=1920),
                                tree_image_endpoint = url_for('tree_image_file',art_id=art_id),
                                tree_file_endpoint =url_for('tree_file',art_id=art_id),
                                tree_file_upload_endpoint = url_for('tree_upload'))
 
+    def make_pooled_art(tier):
+        """
+        generate an art and render its images, for the pool. The images are encoded in all the formats they can
+        be served in, so that every client gets them from the render cache, whatever format it negotiates
+        """
+        art_id = get_art_id(*app.config['ART_POOL_TIERS'][tier])
+        art = app.arts.get_art(art_id)
+        renders = {}
+        for size in (thumbnail_size, 900):
+            img = get_image(art, size=size)
+            for format in app.config['IMAGE_PREVIEW_FORMATS']:
+                renders[(art_id, size, format)] = encode_image(img, format)
+        return art_id, renders
+
+    def get_pooled_art_id(tier):
+        """
+        take a pre-generated art from the pool, its images are put in the render cache;
+        generate a new one if the pool is empty
+        """
+        pooled = app.pool.take(tier)
+        if pooled is None:
+            return get_art_id(*app.config['ART_POOL_TIERS'][tier])
+        art_id, renders = pooled
+        for key, data in renders.items():
+            app.renders.store(key, data)
+        return art_id
+
     @app.route('/')
     def index():
         """ 1st call: the landing page."""
-        art_id = get_art_id(min_arity=15,max_arity=30) # lower arity to start with to reduce initial loading time.
+        art_id = get_pooled_art_id('landing') # the page shows a quick preview while the image renders
         return render_page(art_id)
 
     @app.route('/higher')
     def subsequent_calls():
         """ for subsequent calls (when the user clicks the button); return image of higher complexity"""
-        art_id = get_art_id(min_arity=30,max_arity=80)
+        art_id = get_pooled_art_id('higher')
         return render_page(art_id)
 
+    @app.route('/preview_image_file/<art_id>')
+    def preview_image_file(art_id):
+        """
+        quick, low resolution rendering (thumbnail size), shown (upsampled by the browser) until the
+        rendering for page view is done
+        """
+        return get_wrapped_image_file(art_id,size=thumbnail_size,formats=app.config['IMAGE_PREVIEW_FORMATS'])
+
     @app.route('/image_file/<art_id>')
     def image_file(art_id):
         """
         rendering for page view
         """
-        return get_wrapped_image_file(art_id,size=900)
+        return get_wrapped_image_file(art_id,size=900,formats=app.config['IMAGE_PREVIEW_FORMATS'])
 
     @app.route('/large_image_file/<art_id>')
     def large_image_file(art_id):
         """
-        rendering for printing
+        rendering for printing; if it is not rendered yet, a render job is started and its status is returned
+        (202), the image can be requested again when the job is done
         """
+        if encoding.negotiate(request, ('png',)) is None:
+            abort(400, 'format must be png')  # before a render is started for nothing
+        if app.renders.get((art_id, 1920, 'png')) is None:
+            return submit_render_job(art_id, 1920)
         return get_wrapped_image_file(art_id,size=1920)
 
-    def get_wrapped_image_file(art_id,size):
+    def encode_image(img, format):
+        return encoding.encode(img, format,
+                               png_compress_level=app.config['IMAGE_PNG_COMPRESS_LEVEL'],
+                               quality=app.config['IMAGE_QUALITY'])
+
+    def render_image(art_id,size,format='png'):
+        art = app.arts.get_art(art_id)
+        memo = app.subtrees if app.subtrees is not None else False
+        return encode_image(get_image(art,size=size,memo=memo), format)
+
+    def get_wrapped_image_file(art_id,size,formats=('png',)):
         """
-        render and return the image itself
+        render (or get from the cache) and return the image itself
+        :param formats: the formats the image may be served in (see encoding.negotiate)
         """
-        art = app.arts.get_art(art_id)
-        img = get_image(art,size=size)
-        output = io.BytesIO()
-        img.convert('RGBA').save(output, format='PNG')
-        output.seek(0, 0)
-        w = FileWrapper(output) #this is needed since Flask's send_file() does not work on pythonanywhere: https://www.pythonanywhere.com/forums/topic/13570/
-        return Response(w, mimetype="image/png", direct_passthrough=True)
+        format = encoding.negotiate(request, formats)
+        if format is None:
+            abort(400, f'format must be one of {", ".join(formats)}')
+        response = get_cached_response((art_id, size, format), lambda: render_image(art_id, size, format),
+                                       mimetype=encoding.formats[format])
+        if len(formats) > 1:
+            response.vary.add('Accept')
+        return response
+
+    image_endpoints = {thumbnail_size: 'preview_image_file', 900: 'image_file', 1920: 'large_image_file'}
+
+    @app.route('/render_jobs/<art_id>/<int:size>', methods=['POST'])
+    def render_job(art_id, size):
+        """
+        start rendering the image in the background
+        """
+        if size not in image_endpoints:
+            abort(404)
+        return submit_render_job(art_id, size)
+
+    def submit_render_job(art_id, size):
+        if art_id not in app.arts:
+            abort(404)
+        key = (art_id, size, 'png')
+        try:
+            job = app.jobs.submit(key, lambda: app.renders.get_or_render(key, lambda: render_image(art_id, size)))
+        except QueueFull:
+            response = jsonify(error='Too many images are being rendered, try again later')
+            response.status_code = 429
+            response.headers['Retry-After'] = 10
+            return response
+        response = get_job_response(job)
+        response.status_code = 202
+        response.headers['Location'] = url_for('render_job_status', job_id=job.id)
+        return response
+
+    @app.route('/render_jobs/<job_id>')
+    def render_job_status(job_id):
+        """
+        the status of a render job. With ?wait=<seconds>, the response waits until the job is done
+        (long polling), or at most the given number of seconds, capped by RENDER_JOB_MAX_WAIT
+        """
+        job = app.jobs.get(job_id)
+        if job is None:
+            abort(404)
+        wait = min(request.args.get('wait', 0, type=float), app.config['RENDER_JOB_MAX_WAIT'])
+        if wait > 0:
+            job.wait(wait)
+        return get_job_response(job)
+
+    def get_job_response(job):
+        art_id, size, _ = job.key
+        status = job.status
+        result = dict(job_id=job.id,
+                      status=status,
+                      status_url=url_for('render_job_status', job_id=job.id))
+        if status == 'done':
+            result['image_url'] = url_for(image_endpoints[size], art_id=art_id)
+        elif status == 'failed':
+            result['error'] = str(job.future.exception())
+        elif status == 'cancelled':
+            result['error'] = 'The render was cancelled, the server is shutting down'
+        return jsonify(result)
+
+    def get_cached_response(key, render, mimetype):
+        """
+        response with the rendered image from the cache, with headers so that clients can revalidate cheaply
+        """
+        data, etag, last_modified = app.renders.get_or_render(key, render)
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response.make_conditional(request)
 
     @app.route('/tree_file/<art_id>')
     def tree_file(art_id):
@@ -121,12 +286,14 @@ def create_app(test_config=None):
             s = f.read()
 
             try:
-                art = jsonpickle.decode(s)
-            except JSONDecodeError as e:
-                return f'Invalid JSON file: {e}'
+                if s.startswith(serialization.magic):
+                    art = serialization.decode(s)
+                else:  # json, as downloaded from tree_file
+                    art = serialization.from_jsonpickle(s)
+                art_id = app.arts.add_art(art)  # an art that was uploaded (or generated) before gets its renders
+            except ValueError as e:
+                return f'Invalid art file (json or binary): {e}'
 
-            art_id = uuid.uuid4().hex
-            app.arts.store_art(art_id, art)
             return render_page(art_id)
 
 
@@ -135,18 +302,36 @@ def create_app(test_config=None):
         """
         render and return the image itself
         """
-        art = app.arts.get_art(art_id)
-        get_image(art, size = 200)
-        from nprandomart.treevisualisation import get_tree_with_operator_images,plot_tree_with_images, as_bytesio
-        tree = get_tree_with_operator_images(art)
-        fig = plot_tree_with_images(tree)
-        output = as_bytesio(fig)
+        def render():
+            art = app.arts.get_art(art_id)
+            # the thumbnails of the nodes are captured while rendering the preview, which is cached as well
+            img, thumbnails = get_image_with_thumbnails(art, size=thumbnail_size)
+            preview_key = (art_id, thumbnail_size, 'png')
+            if app.renders.get(preview_key) is None:
+                app.renders.store(preview_key, encode_image(img, 'png'))
+            from nprandomart.treevisualisation import get_tree_with_operator_images, draw_tree_with_images
+            tree = get_tree_with_operator_images(art, thumbnails)
+            return encode_image(draw_tree_with_images(tree), 'png')
 
-        w = FileWrapper(output)
-        return Response(w, mimetype="image/png", direct_passthrough=True)
+        return get_cached_response((art_id, 'tree', 'png'), render, mimetype="image/png")
 
     @app.route('/gallery')
     def gallery():
         return render_template('gallery.html')
 
+    @app.route('/stats')
+    def stats():
+        """hit rates of the pool and caches, and the number of render jobs"""
+        return jsonify(art_pool=app.pool.info(),
+                       arts=app.arts.memory_info(),
+                       renders=app.renders.memory.info(),
+                       subtrees=app.subtrees.info() if app.subtrees is not None else None,
+                       render_jobs=app.jobs.info())
+
+    # the arts that are ready to be served; created last, as it starts generating them in the background
+    app.pool = ArtPool(make_pooled_art,
+                       tiers=app.config['ART_POOL_TIERS'],
+                       size=app.config['ART_POOL_SIZE'],
+                       workers=app.config['ART_POOL_WORKERS'])
+
     return app
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+encoding of the rendered images, and the choice of the format from the request
+"""
+
+import io
+
+# mimetype by format
+formats = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def encode(img, format='png', png_compress_level=3, quality=90):
+    """
+    encode the (RGB) PIL image
+    :param png_compress_level: zlib level (1 to 9) of png; 3 is about as small as the default (6), and faster
+    :param quality: quality of webp and jpeg
+    :return: bytes
+    """
+    output = io.BytesIO()
+    if format == 'png':
+        img.save(output, format='PNG', compress_level=png_compress_level)
+    elif format == 'webp':
+        img.save(output, format='WEBP', quality=quality)
+    elif format == 'jpeg':
+        img.save(output, format='JPEG', quality=quality)
+    else:
+        raise ValueError(f'unknown image format {format}')
+    return output.getvalue()
+
+
+def negotiate(request, allowed):
+    """
+    the format asked for with the 'format' query parameter, or else the best one the Accept header allows
+    :param allowed: the formats that may be served, the first one is served if the client does not prefer another
+    :return: the format, or None if the query parameter asks for one that is not allowed
+    """
+    requested = request.args.get('format')
+    if requested is not None:
+        return requested if requested in allowed else None
+    mimetype = request.accept_mimetypes.best_match([formats[f] for f in allowed])
+    return next((f for f in allowed if formats[f] == mimetype), allowed[0])
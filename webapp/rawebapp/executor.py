@@ -0,0 +1,90 @@
+"""
+a thread pool for the background work of the web app (the art pool, the render jobs).
+The interpreter joins the threads of a concurrent.futures.ThreadPoolExecutor at exit, after they have run all
+the queued work, so that the process (e.g. the tests, or the reloader) would wait for a whole refill of the pool.
+This pool cancels its queued work at exit instead, and waits for the work that is running only. Its threads are
+daemon threads, so that the interpreter does not join them before the atexit handlers have run; they are not
+left running, as they may hold locks (e.g. of the disk caches) that are needed to finalize the interpreter.
+The threads do not reference the pool, so that a pool that is no longer used (e.g. of an app that was created
+for a test) is garbage collected, which stops its threads.
+"""
+
+import atexit
+import queue
+import threading
+import weakref
+from concurrent.futures import Future
+
+_pools = weakref.WeakSet()  # the pools that are alive, shut down at exit
+
+
+def _shutdown_all():
+    for pool in list(_pools):
+        pool.shutdown(wait=True)
+
+
+atexit.register(_shutdown_all)
+
+
+def _work(work_queue):
+    while True:
+        item = work_queue.get()
+        if item is None:
+            return
+        future, function, args = item
+        del item  # nothing of the work is kept while waiting for the next, as it may reference the pool
+        if future.set_running_or_notify_cancel():  # not cancelled
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        del future, function, args
+
+
+def _stop(work_queue, threads, wait):
+    """cancel the queued work, and stop the threads once they have finished their current work"""
+    while True:
+        try:
+            item = work_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not None:
+            item[0].cancel()
+    for _ in threads:
+        work_queue.put(None)
+    if wait:
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+
+class DaemonThreadPool:
+
+    def __init__(self, workers=1, thread_name_prefix='worker'):
+        """
+        :param workers: number of threads
+        :param thread_name_prefix: the threads are named <prefix>_<index>
+        """
+        self.queue = queue.SimpleQueue()
+        self.threads = [threading.Thread(target=_work, args=(self.queue,), name=f'{thread_name_prefix}_{i}',
+                                         daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        # the threads are stopped when the pool is garbage collected; at exit, _shutdown_all waits for them
+        self._finalizer = weakref.finalize(self, _stop, self.queue, self.threads, False)
+        self._finalizer.atexit = False
+        _pools.add(self)
+
+    def submit(self, function, *args):
+        """:return: a Future of function(*args)"""
+        future = Future()
+        self.queue.put((future, function, args))
+        return future
+
+    def shutdown(self, wait=False):
+        """
+        cancel the queued work, and stop the threads once they have finished their current work
+        :param wait: wait until the threads have stopped
+        """
+        _stop(self.queue, self.threads, wait)
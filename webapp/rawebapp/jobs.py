@@ -0,0 +1,94 @@
+"""
+background rendering: a bounded queue of render jobs, run by a pool of threads in the web app process.
+Jobs are identified by a key (e.g. (art_id, size, format)); a job that is submitted while an identical one
+is queued or running gets the id of that job.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+from .executor import DaemonThreadPool
+
+
+class QueueFull(Exception):
+    """raised when the number of queued and running jobs has reached the limit"""
+
+
+class Job:
+
+    def __init__(self, key, future):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.future = future
+        self.created = time.time()
+
+    @property
+    def status(self):
+        """'queued', 'running', 'done', 'failed', or 'cancelled' (the queued jobs, when the app exits)"""
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        if self.future.cancelled():
+            return 'cancelled'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def wait(self, timeout):
+        """wait (at most timeout seconds) until the job is finished"""
+        try:
+            self.future.exception(timeout=timeout)
+        except (FutureTimeoutError, CancelledError):
+            pass
+        return self
+
+
+class RenderQueue:
+
+    def __init__(self, workers=2, max_pending=16, keep_finished=256):
+        """
+        :param workers: number of threads that run the jobs
+        :param max_pending: number of queued and running jobs, above which submit raises QueueFull
+        :param keep_finished: number of finished jobs that are kept, so that their status can be asked for
+        """
+        self.executor = DaemonThreadPool(workers, thread_name_prefix='render')
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()  # by id, oldest first
+        self.pending = {}  # the queued and running jobs, by key
+        self.lock = threading.Lock()
+
+    def submit(self, key, function):
+        """
+        run function() in the background, unless an identical job (the same key) is queued or running
+        :return: the Job
+        """
+        with self.lock:
+            job = self.pending.get(key)
+            if job is not None:
+                return job
+            if len(self.pending) >= self.max_pending:
+                raise QueueFull(f'{len(self.pending)} jobs are queued or running')
+            job = Job(key, self.executor.submit(function))
+            self.jobs[job.id] = job
+            self.pending[key] = job
+        job.future.add_done_callback(lambda future: self._finished(job))
+        return job
+
+    def _finished(self, job):
+        with self.lock:
+            if self.pending.get(job.key) is job:
+                del self.pending[job.key]
+            finished = [j for j in self.jobs.values() if j.future.done()]
+            for j in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[j.id]
+
+    def get(self, job_id):
+        """:return: the Job, or None if it is unknown (or finished long ago)"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def info(self):
+        with self.lock:
+            return {'pending': len(self.pending),
+                    'max_pending': self.max_pending,
+                    'jobs': len(self.jobs)}
@@ -0,0 +1,84 @@
+"""
+a pool of pre-generated arts, so that a page can be served without waiting for the art to be generated and rendered.
+The pool keeps a number of ready items per tier (e.g. per complexity), and refills in the background
+as items are taken.
+"""
+
+import logging
+import threading
+from collections import deque
+from .executor import DaemonThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+class ArtPool:
+
+    def __init__(self, make, tiers, size=4, workers=1):
+        """
+        :param make: function that makes a ready item for a tier, called in the background
+        :param tiers: the names of the tiers
+        :param size: number of ready items kept per tier
+        :param workers: number of threads that make the items
+        """
+        self.make = make
+        self.size = size
+        self.items = {tier: deque() for tier in tiers}
+        self.in_progress = {tier: 0 for tier in tiers}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.executor = DaemonThreadPool(workers, thread_name_prefix='art-pool') if size > 0 else None
+        for tier in tiers:
+            self.refill(tier)
+
+    def refill(self, tier):
+        """start making the items that are missing in the tier"""
+        executor = self.executor  # None once closed
+        if executor is None:
+            return
+        with self.lock:
+            n = self.size - len(self.items[tier]) - self.in_progress[tier]
+            self.in_progress[tier] += max(n, 0)
+        for _ in range(n):
+            executor.submit(self._add, tier)
+
+    def _add(self, tier):
+        try:
+            item = self.make(tier)
+        except Exception:
+            logger.exception(f'making an item for the {tier} pool failed')
+            item = None
+        with self.lock:
+            self.in_progress[tier] -= 1
+            if item is not None:
+                self.items[tier].append(item)
+
+    def take(self, tier):
+        """:return: a ready item of the tier, or None if there is none (yet)"""
+        with self.lock:
+            try:
+                item = self.items[tier].popleft()
+            except IndexError:
+                item = None
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.refill(tier)
+        return item
+
+    def close(self):
+        """stop making items; the ones that are queued are not made"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def info(self):
+        """hit/miss statistics and the number of ready items per tier"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.,
+                    'ready': {tier: len(items) for tier, items in self.items.items()},
+                    'size': self.size}
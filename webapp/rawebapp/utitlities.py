@@ -18,15 +18,104 @@ class LimitedSizeDict(OrderedDict):
 
 
 from diskcache import Cache
-import jsonpickle
+import hashlib
+import threading
+import time
+from nprandomart.cache import LRUCache
+from nprandomart import serialization
 
 class ArtDiskCache(Cache):
+    """
+    arts by id, stored in the compact binary format (see nprandomart.serialization).
+    The id of an art is its structural hash (see add_art), except for the arts stored with an id of their own.
+    The recently used arts are also kept decoded in memory, so that the requests of a page view
+    do not read and decode the same art again. The arts are shared by those requests, so they must
+    not be modified.
+    """
 
-    def __init__(self,*args,**kwargs):
+    def __init__(self,*args,memory_limit=256,**kwargs):
+        """
+        :param memory_limit: number of decoded arts kept in memory
+        """
         super().__init__(*args,**kwargs)
+        self.memory = LimitedSizeDict(size_limit=memory_limit)
+        self.memory_lock = threading.Lock()
+        self.memory_hits = 0
+        self.memory_misses = 0
 
     def store_art(self,id,art):
-        self[id] = jsonpickle.encode(art)
+        self[id] = serialization.encode(art)
+        with self.memory_lock:
+            self.memory[id] = art
+
+    def add_art(self, art):
+        """
+        store the art by its structural hash, unless an identical art is stored already
+        :return: the id (hash) of the art
+        """
+        art_id = serialization.structural_hash(art)
+        if art_id not in self:
+            self.store_art(art_id, art)
+        return art_id
 
     def get_art(self,id):
-        return jsonpickle.decode(self[id])
\ No newline at end of file
+        with self.memory_lock:
+            try:
+                art = self.memory[id]
+            except KeyError:
+                self.memory_misses += 1
+            else:
+                self.memory.move_to_end(id)
+                self.memory_hits += 1
+                return art
+
+        data = self[id]
+        if isinstance(data, str):  # stored as jsonpickle, by an earlier version
+            art = serialization.from_jsonpickle(data)
+        else:
+            art = serialization.decode(data)
+        with self.memory_lock:
+            self.memory[id] = art
+        return art
+
+    def memory_info(self):
+        """hit/miss statistics of the decoded arts in memory"""
+        with self.memory_lock:
+            total = self.memory_hits + self.memory_misses
+            return {'hits': self.memory_hits,
+                    'misses': self.memory_misses,
+                    'hit_rate': self.memory_hits / total if total else 0.,
+                    'items': len(self.memory),
+                    'max_items': self.memory.size_limit}
+
+
+class RenderCache:
+    """
+    rendered images by (art_id, size, format): an in-memory LRU cache in front of a disk cache.
+    Entries are (data, etag, last_modified timestamp)
+    """
+
+    def __init__(self, directory, memory_limit=64e6, disk_limit=512e6):
+        self.memory = LRUCache(max_bytes=memory_limit, sizeof=lambda entry: len(entry[0]))
+        self.disk = Cache(directory=directory, size_limit=disk_limit)
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.put(key, entry)
+        return entry
+
+    def store(self, key, data):
+        entry = (data, hashlib.sha1(data).hexdigest(), time.time())
+        self.memory.put(key, entry)
+        self.disk.set(key, entry)
+        return entry
+
+    def get_or_render(self, key, render):
+        """return the cached entry, or render (a function that returns bytes) and store it"""
+        entry = self.get(key)
+        if entry is None:
+            entry = self.store(key, render())
+        return entry
@@ -1,10 +1,15 @@
+import time
 import pytest
 from rawebapp import create_app
-from flask_testing import TestCase
+
+def make_app(instance_path, **config):
+    """an app with its caches in instance_path (a tmp_path); no pre-generated arts, nor numba, so that creating
+    the app is quick"""
+    return create_app({'TESTING':True, 'ART_POOL_SIZE':0, 'WARMUP':False, **config}, instance_path=str(instance_path))
 
 @pytest.fixture
-def app():
-    app = create_app({'TESTING':True})
+def app(tmp_path):
+    app = make_app(tmp_path)
     yield app
 
 @pytest.fixture
@@ -17,4 +22,197 @@ def runner(app):
 
 def test_new_image(client):
     response = client.get('/')
-    assert 'action="/higher"' in str(response.data) #TODO more thorough test
\ No newline at end of file
+    assert 'action="/higher"' in str(response.data) #TODO more thorough test
+
+def wait_for(condition, timeout=30):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+# art pool tests
+from rawebapp.pool import ArtPool
+
+def test_pool():
+    pool = ArtPool(lambda tier: tier, tiers=['a', 'b'], size=2)
+    wait_for(lambda: pool.info()['ready'] == {'a': 2, 'b': 2})
+    assert pool.take('a') == 'a'
+    assert pool.info()['hits'] == 1
+    wait_for(lambda: pool.info()['ready']['a'] == 2)  # refilled
+    pool.close()
+    assert pool.take('b') == 'b'  # the ready items are still served
+    empty = ArtPool(lambda tier: tier, tiers=['a'], size=0)
+    assert empty.take('a') is None
+    assert empty.info()['misses'] == 1
+
+def test_stats(tmp_path):
+    app = make_app(tmp_path, ART_POOL_SIZE=1, ART_POOL_TIERS={'landing': (2, 3), 'higher': (2, 3)})
+    client = app.test_client()
+    wait_for(lambda: client.get('/stats').get_json()['art_pool']['ready']['landing'] == 1)
+    client.get('/')
+    stats = client.get('/stats').get_json()
+    assert stats['art_pool']['hits'] == 1
+    assert {'arts', 'renders', 'render_jobs'} <= set(stats)
+    app.pool.close()
+
+def test_pooled_formats(tmp_path):
+    import re
+    app = make_app(tmp_path, ART_POOL_SIZE=1, ART_POOL_TIERS={'landing': (2, 3), 'higher': (2, 3)})
+    client = app.test_client()
+    wait_for(lambda: app.pool.info()['ready']['landing'] == 1)
+    art_id = re.search(r'/preview_image_file/(\w+)', client.get('/').get_data(as_text=True)).group(1)
+    assert app.pool.info()['hits'] == 1
+    misses = app.renders.memory.info()['misses']
+    for format, mimetype in (('webp', 'image/webp'), ('png', 'image/png'), ('jpeg', 'image/jpeg')):
+        response = client.get(f'/image_file/{art_id}', headers={'Accept': mimetype})
+        assert response.mimetype == mimetype
+    assert app.renders.memory.info()['misses'] == misses  # none of the formats is rendered again
+    app.pool.close()
+
+
+# render job tests
+import threading
+from nprandomart.randomart import Product, Constant, VariableX
+
+def wait_for_job(client, status_url):
+    """poll the status of the job until it is finished, as the page does"""
+    wait_for(lambda: client.get(status_url).get_json()['status'] not in ('queued', 'running'))
+    return client.get(status_url).get_json()
+
+def new_art_id(app):
+    """a small art that was not rendered before (its color is random)"""
+    return app.arts.add_art(Product(Constant(), VariableX()))
+
+@pytest.fixture
+def small_queue_app(tmp_path):
+    app = make_app(tmp_path, RENDER_WORKERS=1, RENDER_QUEUE_LIMIT=3)
+    yield app
+
+def test_render_jobs(small_queue_app):
+    app = small_queue_app
+    client = app.test_client()
+    art_id, other_id = new_art_id(app), new_art_id(app)
+    blocked = threading.Event()
+    app.jobs.submit(('blocking', 1920, 'png'), blocked.wait)  # keeps the only worker busy
+    response = client.post(f'/render_jobs/{art_id}/1920')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'queued'
+    assert response.headers['Location'].endswith(job['status_url'])
+    assert client.post(f'/render_jobs/{art_id}/1920').get_json()['job_id'] == job['job_id']  # the same key
+    client.post(f'/render_jobs/{other_id}/900')
+    response = client.post(f'/render_jobs/{other_id}/1920')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+    assert client.post(f'/render_jobs/{art_id}/300').status_code == 404
+    start = time.time()
+    assert client.get(job['status_url'] + '?wait=30').get_json()['status'] == 'queued'  # long polling,
+    assert time.time() - start < 10  # but capped by RENDER_JOB_MAX_WAIT, so that it holds a worker briefly
+    blocked.set()
+    status = wait_for_job(client, job['status_url'])
+    assert status['status'] == 'done'
+    response = client.get(status['image_url'])
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+
+def test_failed_render_job(app):
+    client = app.test_client()
+    def fail():
+        raise RuntimeError('out of paint')
+    job = app.jobs.submit((new_art_id(app), 1920, 'png'), fail)
+    status = wait_for_job(client, f'/render_jobs/{job.id}')
+    assert status['status'] == 'failed'
+    assert 'out of paint' in status['error']
+    assert client.get('/render_jobs/unknown').status_code == 404
+
+def test_cancelled_render_job(small_queue_app):
+    app = small_queue_app
+    client = app.test_client()
+    blocked = threading.Event()
+    app.jobs.submit(('blocking', 1920, 'png'), blocked.wait)
+    job = app.jobs.submit((new_art_id(app), 1920, 'png'), lambda: None)
+    job.future.cancel()  # as the queued jobs are at exit
+    status = client.get(f'/render_jobs/{job.id}?wait=1').get_json()
+    assert status['status'] == 'cancelled' and status['error']
+    blocked.set()
+
+def test_large_image_file(app):
+    client = app.test_client()
+    art_id = new_art_id(app)
+    response = client.get(f'/large_image_file/{art_id}')
+    assert response.status_code == 202  # rendering in the background
+    wait_for_job(client, response.get_json()['status_url'])
+    response = client.get(f'/large_image_file/{art_id}')
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+
+
+# image response tests
+def test_conditional_image(app):
+    client = app.test_client()
+    art_id = new_art_id(app)
+    response = client.get(f'/preview_image_file/{art_id}')
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    assert response.headers['ETag'] and response.headers['Last-Modified']
+    response = client.get(f'/preview_image_file/{art_id}', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_image_format(app):
+    client = app.test_client()
+    art_id = new_art_id(app)
+    response = client.get(f'/preview_image_file/{art_id}?format=webp')
+    assert response.mimetype == 'image/webp' and response.data[8:12] == b'WEBP'
+    assert 'Accept' in response.headers['Vary']
+    response = client.get(f'/preview_image_file/{art_id}', headers={'Accept': 'image/jpeg,image/*;q=0.8'})
+    assert response.mimetype == 'image/jpeg'
+    response = client.get(f'/preview_image_file/{art_id}', headers={'Accept': 'text/html,*/*;q=0.8'})
+    assert response.mimetype == 'image/png'  # the first allowed format
+    assert client.get(f'/preview_image_file/{art_id}?format=gif').status_code == 400
+    assert client.get(f'/large_image_file/{art_id}?format=webp').status_code == 400  # png only
+
+
+def test_subtree_memo(client, tmp_path):
+    from nprandomart.randomart import Sin, VariableY
+    assert client.get('/stats').get_json()['subtrees'] is None  # off by default
+    app = make_app(tmp_path / 'memo', SUBTREE_MEMO_LIMIT=8e6)
+    client = app.test_client()
+    art_id = app.arts.add_art(Product(Sin(Product(VariableX(), VariableY())), Constant()))
+    client.get(f'/preview_image_file/{art_id}')
+    subtrees = client.get('/stats').get_json()['subtrees']
+    assert 0 < subtrees['bytes'] <= 8e6
+    app.renders.memory.clear()
+    app.renders.disk.clear()
+    client.get(f'/preview_image_file/{art_id}')  # rendered again
+    assert client.get('/stats').get_json()['subtrees']['hits'] > subtrees['hits']
+
+
+def test_deep_upload(client):
+    import io
+    from nprandomart import serialization, structural_hash
+    def chain(depth):
+        return ('{"py/object": "nprandomart.randomart.Tent", "py/state": {"e": ' * (depth - 1) +
+                '{"py/object": "nprandomart.randomart.VariableX"}' + '}}' * (depth - 1))
+    deepest = chain(serialization.max_depth)
+    response = client.post('/tree_upload', data={'file': (io.BytesIO(deepest.encode()), 'art.json')})
+    assert response.status_code == 200
+    art_id = structural_hash(serialization.from_jsonpickle(deepest))
+    for endpoint in ('tree_file', 'tree_image_file', 'preview_image_file', 'image_file'):
+        assert client.get(f'/{endpoint}/{art_id}').status_code == 200  # the tree is not too deep for any of them
+    response = client.post('/tree_upload', data={'file': (io.BytesIO(chain(serialization.max_depth + 1).encode()),
+                                                          'art.json')})
+    assert b'deeper than' in response.data
+    response = client.post('/tree_upload', data={'file': (io.BytesIO(serialization.magic + b'\x01'), 'art.npra')})
+    assert b'Invalid art file' in response.data  # binary uploads are reported as such, not as json
+
+
+def test_app_is_collected(tmp_path):
+    import gc
+    import weakref
+    app = make_app(tmp_path, ART_POOL_SIZE=1, ART_POOL_TIERS={'landing': (2, 3), 'higher': (2, 3)})
+    wait_for(lambda: app.pool.info()['ready'] == {'landing': 1, 'higher': 1})
+    app.jobs.submit(('job', 1, 'png'), lambda: None).future.result()
+    threads = app.jobs.executor.threads + app.pool.executor.threads
+    app = weakref.ref(app)
+    gc.collect()
+    assert app() is None  # the background threads do not keep it alive, until exit
+    wait_for(lambda: not any(thread.is_alive() for thread in threads))